@@ -7,19 +7,39 @@ Prepares the application for production deployment
 import os
 import shutil
 import sys
+from pathlib import Path
+
+SRC_DIR = Path('src')
+
+def find_existing(paths):
+    """Return the subset of paths that exist, scanning each parent directory once"""
+    by_parent = {}
+    for path in map(Path, paths):
+        by_parent.setdefault(path.parent, []).append(path)
+    
+    found = set()
+    for parent, children in by_parent.items():
+        try:
+            with os.scandir(parent) as entries:
+                names = {entry.name for entry in entries}
+        except FileNotFoundError:
+            continue
+        found.update(child for child in children if child.name in names)
+    return found
 
 def prepare_for_production():
     """Prepare application for production deployment"""
     print("🚀 Preparing WasatPay for production deployment...")
     
     # Replace main.py with production version
-    main_path = os.path.join('src', 'main.py')
-    production_main_path = os.path.join('src', 'main_production.py')
+    main_path = SRC_DIR / 'main.py'
+    production_main_path = SRC_DIR / 'main_production.py'
+    backup_path = SRC_DIR / 'main_development.py'
+    src_files = find_existing([main_path, production_main_path])
     
-    if os.path.exists(production_main_path):
+    if production_main_path in src_files:
         # Backup original main.py
-        backup_path = os.path.join('src', 'main_development.py')
-        if os.path.exists(main_path):
+        if main_path in src_files:
             shutil.copy2(main_path, backup_path)
             print(f"✅ Backed up original main.py to {backup_path}")
         
@@ -30,22 +50,20 @@ def prepare_for_production():
         print(f"❌ Production main file not found: {production_main_path}")
         return False
     
-    # Create necessary directories
+    # Create necessary directories (parents are created along the way)
     directories = [
-        'src/static',
-        'src/static/assets',
         'src/static/assets/images',
         'uploads',
         'logs'
     ]
     
     for directory in directories:
-        os.makedirs(directory, exist_ok=True)
+        Path(directory).mkdir(parents=True, exist_ok=True)
         print(f"✅ Created directory: {directory}")
     
     # Copy logo to static assets
-    logo_source = os.path.join('src', 'static', 'assets', 'images', 'wasat-logo-official.png')
-    if os.path.exists(logo_source):
+    logo_source = SRC_DIR / 'static' / 'assets' / 'images' / 'wasat-logo-official.png'
+    if logo_source.is_file():
         print(f"✅ Wasat logo found at {logo_source}")
     else:
         print(f"⚠️  Wasat logo not found at {logo_source}")
@@ -57,9 +75,10 @@ def prepare_for_production():
         '.do/app.yaml',
         'src/config.py'
     ]
+    existing_files = find_existing(required_files)
     
     for file_path in required_files:
-        if os.path.exists(file_path):
+        if Path(file_path) in existing_files:
             print(f"✅ Required file found: {file_path}")
         else:
             print(f"❌ Required file missing: {file_path}")
@@ -79,10 +98,10 @@ def restore_development():
     """Restore development configuration"""
     print("🔄 Restoring development configuration...")
     
-    main_path = os.path.join('src', 'main.py')
-    backup_path = os.path.join('src', 'main_development.py')
+    main_path = SRC_DIR / 'main.py'
+    backup_path = SRC_DIR / 'main_development.py'
     
-    if os.path.exists(backup_path):
+    if backup_path.is_file():
         shutil.copy2(backup_path, main_path)
         print(f"✅ Restored development main.py from {backup_path}")
     else:
@@ -5,9 +5,12 @@ import multiprocessing
 bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
 backlog = 2048
 
-# Worker processes
+# Worker processes; each runs a few threads so a request waiting on the
+# database doesn't hold up the whole process. DB_POOL_SIZE defaults to
+# GUNICORN_THREADS so every thread can get a pooled connection.
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -48,6 +51,12 @@ def pre_fork(server, worker):
 
 def post_fork(server, worker):
     server.log.info("Worker spawned (pid: %s)", worker.pid)
+    
+    # With preload_app the master may have opened pooled connections; drop
+    # them in the worker so it never shares a socket with another process
+    from src.models.user import db
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=False)
 
 def post_worker_init(worker):
     worker.log.info("Worker initialized (pid: %s)", worker.pid)
@@ -0,0 +1,65 @@
+from flask import current_app
+
+# One client (and connection pool) per Redis URL, shared by all requests in the process
+_clients = {}
+
+def get_cache():
+    """Get the Redis client for REDIS_URL, or None when no cache is configured"""
+    url = current_app.config.get('REDIS_URL')
+    if not url:
+        return None
+    
+    client = _clients.get(url)
+    if client is None:
+        import redis
+        client = _clients[url] = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return client
+
+def cache_get(key):
+    """Get a cached value, or None on a miss or when the cache is unavailable"""
+    client = get_cache()
+    if client is None:
+        return None
+    
+    import redis
+    try:
+        return client.get(key)
+    except redis.RedisError as e:
+        current_app.logger.warning(f"Cache read failed for {key}: {str(e)}")
+        return None
+
+def cache_set(key, value, ttl):
+    """Store a value for ttl seconds; cache errors are logged, not raised"""
+    client = get_cache()
+    if client is None:
+        return
+    
+    import redis
+    try:
+        client.setex(key, ttl, value)
+    except redis.RedisError as e:
+        current_app.logger.warning(f"Cache write failed for {key}: {str(e)}")
+
+def cache_delete(*keys):
+    """Drop cached values after the data behind them changes"""
+    client = get_cache()
+    if client is None:
+        return
+    
+    import redis
+    try:
+        client.delete(*keys)
+    except redis.RedisError as e:
+        current_app.logger.warning(f"Cache invalidation failed for {', '.join(keys)}: {str(e)}")
+
+def cache_incr(key):
+    """Bump a counter, e.g. a generation number that is part of other keys"""
+    client = get_cache()
+    if client is None:
+        return
+    
+    import redis
+    try:
+        client.incr(key)
+    except redis.RedisError as e:
+        current_app.logger.warning(f"Cache increment failed for {key}: {str(e)}")
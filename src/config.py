@@ -1,5 +1,6 @@
 import os
 from datetime import timedelta
+from functools import lru_cache
 
 class Config:
     """Base configuration class"""
@@ -9,7 +10,7 @@ class Config:
     
     # Database settings
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_RECORD_QUERIES = True
+    SQLALCHEMY_RECORD_QUERIES = False
     
     # JWT settings
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or SECRET_KEY
@@ -33,6 +34,9 @@ class Config:
     FLUTTERWAVE_SECRET_KEY = os.environ.get('FLUTTERWAVE_SECRET_KEY')
     FLUTTERWAVE_WEBHOOK_SECRET = os.environ.get('FLUTTERWAVE_WEBHOOK_SECRET')
     
+    # Shared cache (Redis); caching is off when unset
+    REDIS_URL = os.environ.get('REDIS_URL')
+    
     # CORS settings
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*').split(',')
     
@@ -56,6 +60,9 @@ class DevelopmentConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         f"sqlite:///{os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'app.db')}"
     
+    # Record per-request query info only when explicitly profiling
+    SQLALCHEMY_RECORD_QUERIES = os.environ.get('SQLALCHEMY_RECORD_QUERIES', 'false').lower() in ['true', 'on', '1']
+    
     # Development-specific settings
     MAIL_SUPPRESS_SEND = False  # Set to True to suppress email sending in development
     WTF_CSRF_ENABLED = False
@@ -71,12 +78,29 @@ class ProductionConfig(Config):
         # Fix for SQLAlchemy 1.4+ which doesn't support postgres:// URLs
         SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace('postgres://', 'postgresql://', 1)
     
+    # Connection pool sizing (per worker process). Each gunicorn thread holds at
+    # most one connection through its scoped session, so the pool follows
+    # GUNICORN_THREADS and the overflow only covers short bursts; the database
+    # sees up to workers * (pool size + overflow) connections in total
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or os.environ.get('GUNICORN_THREADS') or 4)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 2)
+    
+    # Compiled SQL statements kept per engine; sized above the number of distinct
+    # statement shapes the routes' optional filters produce so the LRU doesn't churn
+    DB_QUERY_CACHE_SIZE = int(os.environ.get('DB_QUERY_CACHE_SIZE') or 1200)
+    
     # Production-specific settings
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,
+        'query_cache_size': DB_QUERY_CACHE_SIZE,
         'pool_recycle': 300,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
         'pool_timeout': 20,
-        'max_overflow': 0
+        'connect_args': {
+            'connect_timeout': 5,
+            'options': '-c statement_timeout=30000'  # Match the 30s worker timeout
+        }
     }
     
     # Security settings
@@ -102,8 +126,9 @@ config = {
     'default': DevelopmentConfig
 }
 
+@lru_cache(maxsize=1)
 def get_config():
-    """Get configuration based on environment"""
+    """Get configuration based on environment (resolved once per process)"""
     env = os.environ.get('FLASK_ENV', 'development')
     return config.get(env, config['default'])
 
@@ -0,0 +1,34 @@
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, keeping Flask's default serialization rules"""
+    
+    # Let Flask's default() format dates and dataclasses as it always has
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    
+    def dumps_bytes(self, obj, indent=None):
+        """Serialize data as UTF-8 JSON bytes"""
+        option = self.OPTIONS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+    
+    def dumps(self, obj, **kwargs):
+        """Serialize data as JSON to a string"""
+        return self.dumps_bytes(obj, indent=kwargs.get('indent')).decode()
+    
+    def loads(self, s, **kwargs):
+        """Deserialize data as JSON from a string or bytes"""
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        """Serialize the given arguments as a JSON response without a str round-trip"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        
+        return self._app.response_class(
+            self.dumps_bytes(obj, indent=indent) + b"\n", mimetype=self.mimetype
+        )
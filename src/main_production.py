@@ -3,9 +3,13 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+import time
+from functools import lru_cache
 from flask import Flask, send_from_directory, jsonify
 from flask_cors import CORS
+from sqlalchemy import text
 from src.config import get_config
+from src.json_provider import OrjsonProvider
 from src.models.user import db
 from src.models.customer import Customer
 from src.models.invoice import Invoice, InvoiceLineItem, InvoiceStatusHistory
@@ -22,9 +26,30 @@ from src.routes.payment import payment_bp
 from src.routes.public_payment import public_payment_bp
 from src.routes.project import project_bp
 
+# Seconds a database health probe result is reused by /api/health
+HEALTH_CHECK_TTL = 5
+
+def init_db(app):
+    """Create database tables for the given app"""
+    with app.app_context():
+        # Ensure database directory exists for SQLite
+        if 'sqlite' in app.config['SQLALCHEMY_DATABASE_URI']:
+            db_dir = os.path.dirname(app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir, exist_ok=True)
+        
+        # Re-raised so the init-db deploy job fails instead of reporting success
+        try:
+            db.create_all()
+            print("Database tables created successfully")
+        except Exception as e:
+            print(f"Error creating database tables: {e}")
+            raise
+
 def create_app(config_name=None):
     """Application factory pattern"""
     app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    app.json = OrjsonProvider(app)
     
     # Load configuration
     if config_name is None:
@@ -49,30 +74,66 @@ def create_app(config_name=None):
     app.register_blueprint(public_payment_bp, url_prefix='/api/public')
     app.register_blueprint(project_bp, url_prefix='/api/projects')
     
-    # Create database tables
-    with app.app_context():
-        # Ensure database directory exists for SQLite
-        if 'sqlite' in app.config['SQLALCHEMY_DATABASE_URI']:
-            db_dir = os.path.dirname(app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
-            if db_dir and not os.path.exists(db_dir):
-                os.makedirs(db_dir, exist_ok=True)
-        
-        try:
-            db.create_all()
-            print("Database tables created successfully")
-        except Exception as e:
-            print(f"Error creating database tables: {e}")
+    # Invoice emails need the mail settings and Flask-Mail extension on the app
+    from src.services.invoice_service import invoice_service
+    invoice_service.init_app(app)
+    
+    # Create database tables only when explicitly requested; in production
+    # this is done once per deploy via `flask --app src.main init-db`
+    if os.environ.get('WASATPAY_INIT_DB', 'false').lower() in ['true', 'on', '1']:
+        init_db(app)
+    
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create database tables"""
+        init_db(app)
+    
+    @app.cli.command('sweep-overdue')
+    def sweep_overdue_command():
+        """Mark sent invoices past their due date as overdue"""
+        from src.models.invoice import Invoice
+        overdue_ids = Invoice.sweep_overdue()
+        db.session.commit()
+        print(f"Marked {len(overdue_ids)} invoice(s) overdue")
+    
+    @app.cli.command('backfill-total-paid')
+    def backfill_total_paid_command():
+        """Recompute stored invoice totals paid from completed payments"""
+        from src.models.invoice import Invoice
+        updated = Invoice.backfill_total_paid()
+        db.session.commit()
+        print(f"Recomputed total paid for {updated} invoice(s)")
+    
+    @app.cli.command('backfill-total-invoiced')
+    def backfill_total_invoiced_command():
+        """Recompute stored project totals invoiced from their invoices"""
+        from src.models.project import Project
+        updated = Project.backfill_total_invoiced()
+        db.session.commit()
+        print(f"Recomputed total invoiced for {updated} project(s)")
+    
+    # Health check endpoint; the database probe result is reused for a few
+    # seconds so frequent load balancer checks don't each cost a round-trip
+    health_cache = {'checked_at': None, 'db_status': None}
     
-    # Health check endpoint
     @app.route('/api/health')
     def health_check():
         """Health check endpoint for load balancers"""
-        try:
-            # Test database connection
-            db.session.execute('SELECT 1')
-            db_status = 'healthy'
-        except Exception as e:
-            db_status = f'unhealthy: {str(e)}'
+        now = time.monotonic()
+        checked_at = health_cache['checked_at']
+        
+        if checked_at is not None and now - checked_at < HEALTH_CHECK_TTL:
+            db_status = health_cache['db_status']
+        else:
+            try:
+                # Test database connection
+                db.session.execute(text('SELECT 1'))
+                db_status = 'healthy'
+            except Exception as e:
+                db_status = f'unhealthy: {str(e)}'
+            
+            health_cache['checked_at'] = now
+            health_cache['db_status'] = db_status
         
         return jsonify({
             'status': 'healthy' if db_status == 'healthy' else 'unhealthy',
@@ -106,17 +167,22 @@ def create_app(config_name=None):
             }
         })
     
-    # Serve static files and handle SPA routing
+    # Serve static files and handle SPA routing; the static folder contents
+    # are fixed for the lifetime of a worker, so existence checks are cached
+    static_folder_path = app.static_folder
+    index_exists = os.path.exists(os.path.join(static_folder_path, 'index.html'))
+    
+    @lru_cache(maxsize=1024)
+    def static_file_exists(path):
+        return os.path.exists(os.path.join(static_folder_path, path))
+    
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
     def serve_frontend(path):
         """Serve frontend static files or API info"""
-        static_folder_path = app.static_folder
-        
         # If path is empty or doesn't exist, try to serve index.html
-        if path == '' or not os.path.exists(os.path.join(static_folder_path, path)):
-            index_path = os.path.join(static_folder_path, 'index.html')
-            if os.path.exists(index_path):
+        if path == '' or not static_file_exists(path):
+            if index_exists:
                 return send_from_directory(static_folder_path, 'index.html')
             else:
                 return jsonify({
@@ -151,8 +217,18 @@ def create_app(config_name=None):
 # Create the app instance
 app = create_app()
 
+# On Vercel this module is the function entry point; open one pooled
+# connection at import so warm starts don't pay for it on the first request
+if os.environ.get('VERCEL'):
+    with app.app_context():
+        try:
+            db.engine.connect().close()
+        except Exception as e:
+            app.logger.warning(f"Database warmup skipped: {e}")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
+    init_db(app)
     app.run(host='0.0.0.0', port=port, debug=debug)
 
@@ -1,16 +1,57 @@
 from src.models.user import db
-from datetime import datetime
+from src.models.functions import utcnow
+from src.models.types import EnumName
+from src.pagination import after_cursor
 from enum import Enum
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import validates
+import re
+import time
+
+# Words usable as full-text prefix terms in Customer.search
+SEARCH_WORD_RE = re.compile(r'\w+')
+
+# Text search configuration for Customer.search; rendered inline so the
+# query expression matches the index expression
+SEARCH_CONFIG = db.text("'simple'::regconfig")
+
+# Seconds a Customer.cached_count result is reused, and the most entries kept
+COUNT_CACHE_TTL = 30
+COUNT_CACHE_SIZE = 1024
+_count_cache = {}
 
 class CustomerType(Enum):
     INDIVIDUAL = "individual"
     ORGANIZATION = "organization"
 
+# Valid customer_type strings, for validating request input
+CUSTOMER_TYPE_VALUES = frozenset(t.value for t in CustomerType)
+
+def _trigram_index(column):
+    """Build a PostgreSQL-only GIN trigram index for substring (ILIKE) search"""
+    return db.Index(
+        f'ix_customers_{column}_trgm',
+        column,
+        postgresql_using='gin',
+        postgresql_ops={column: 'gin_trgm_ops'}
+    ).ddl_if(dialect='postgresql')
+
 class Customer(db.Model):
     __tablename__ = 'customers'
+    __table_args__ = (
+        # Default listing / search filter and ordering; on PostgreSQL it also
+        # covers the summary columns so summary listings are index-only scans
+        db.Index(
+            'ix_customers_active_created', 'is_active', 'created_at', 'id',
+            postgresql_include=['customer_type', 'first_name', 'last_name', 'organization_name', 'primary_email']
+        ),
+        # Secondary email substring match in Customer.search; names and the
+        # primary email go through ix_customers_list_search_trgm
+        _trigram_index('secondary_email'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    customer_type = db.Column(db.Enum(CustomerType), nullable=False, default=CustomerType.INDIVIDUAL)
+    customer_type = db.Column(EnumName(CustomerType), nullable=False, default=CustomerType.INDIVIDUAL)
     
     # Individual customer fields
     first_name = db.Column(db.String(100))
@@ -23,7 +64,7 @@ class Customer(db.Model):
     registration_number = db.Column(db.String(100))
     
     # Contact information
-    primary_email = db.Column(db.String(120), nullable=False, index=True)
+    primary_email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     secondary_email = db.Column(db.String(120))
     phone_primary = db.Column(db.String(20))
     phone_secondary = db.Column(db.String(20))
@@ -60,12 +101,32 @@ class Customer(db.Model):
     notes = db.Column(db.Text)
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    # Filled in by the database clock so all workers agree
+    created_at = db.Column(db.DateTime, server_default=utcnow(), nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=utcnow(), onupdate=utcnow(), nullable=False)
     last_contact_date = db.Column(db.DateTime)
     
     # Relationships
-    invoices = db.relationship('Invoice', backref='customer', lazy=True)
+    invoices = db.relationship('Invoice', back_populates='customer', lazy='dynamic')
+    
+    # Columns read by to_dict / bulk_to_dict
+    _SERIALIZED_FIELDS = (
+        'id', 'customer_type', 'first_name', 'last_name',
+        'organization_name', 'organization_type', 'tax_id', 'registration_number',
+        'primary_email', 'secondary_email', 'phone_primary', 'phone_secondary', 'website',
+        'address_line1', 'address_line2', 'city', 'state_province', 'postal_code', 'country',
+        'billing_address_line1', 'billing_address_line2', 'billing_city',
+        'billing_state_province', 'billing_postal_code', 'billing_country',
+        'preferred_currency', 'preferred_language', 'payment_terms',
+        'email_notifications', 'sms_notifications', 'whatsapp_notifications',
+        'is_active', 'notes', 'created_at', 'updated_at', 'last_contact_date'
+    )
+    
+    # Columns behind to_summary_dict, enough for pickers and typeahead
+    _SUMMARY_FIELDS = (
+        'id', 'customer_type', 'first_name', 'last_name',
+        'organization_name', 'primary_email', 'created_at'
+    )
     
     def __repr__(self):
         if self.customer_type == CustomerType.INDIVIDUAL:
@@ -73,151 +134,315 @@ class Customer(db.Model):
         else:
             return f'<Customer {self.organization_name}>'
     
+    @staticmethod
+    def normalize_email(email):
+        """Lowercase and strip an email so the unique index catches duplicates"""
+        return email.strip().lower() if email else email
+    
+    @validates('primary_email')
+    def normalize_primary_email(self, key, email):
+        """Store primary emails normalized"""
+        return self.normalize_email(email)
+    
     @property
     def display_name(self):
         """Get display name based on customer type"""
-        if self.customer_type == CustomerType.INDIVIDUAL:
-            return f"{self.first_name} {self.last_name}".strip()
-        else:
-            return self.organization_name or "Unknown Organization"
+        return self._display_name(self)
     
     @property
     def full_address(self):
         """Get formatted full address"""
-        address_parts = [
-            self.address_line1,
-            self.address_line2,
-            self.city,
-            self.state_province,
-            self.postal_code,
-            self.country
-        ]
-        return ", ".join([part for part in address_parts if part])
+        return self._formatted_addresses(self)[0]
     
     @property
     def full_billing_address(self):
         """Get formatted billing address or fall back to primary address"""
-        if self.billing_address_line1:
-            billing_parts = [
-                self.billing_address_line1,
-                self.billing_address_line2,
-                self.billing_city,
-                self.billing_state_province,
-                self.billing_postal_code,
-                self.billing_country
-            ]
-            return ", ".join([part for part in billing_parts if part])
+        return self._formatted_addresses(self)[1]
+    
+    @staticmethod
+    def _display_name(record):
+        """Get display name for a customer or a row of customer columns"""
+        if record.customer_type == CustomerType.INDIVIDUAL:
+            first_name = record.first_name
+            last_name = record.last_name
+            if first_name and last_name:
+                return f"{first_name} {last_name}"
+            return first_name or last_name or "Unknown"
         else:
-            return self.full_address
+            return record.organization_name or "Unknown Organization"
     
-    def get_contact_info(self):
-        """Get all contact information"""
-        return {
-            'primary_email': self.primary_email,
-            'secondary_email': self.secondary_email,
-            'phone_primary': self.phone_primary,
-            'phone_secondary': self.phone_secondary,
-            'website': self.website
-        }
+    @staticmethod
+    def _formatted_addresses(record):
+        """Get formatted (primary, billing) addresses in a single pass"""
+        primary = ", ".join(part for part in (
+            record.address_line1,
+            record.address_line2,
+            record.city,
+            record.state_province,
+            record.postal_code,
+            record.country
+        ) if part)
+        
+        billing_line1 = record.billing_address_line1
+        if not billing_line1:
+            return primary, primary
+        
+        billing = ", ".join(part for part in (
+            billing_line1,
+            record.billing_address_line2,
+            record.billing_city,
+            record.billing_state_province,
+            record.billing_postal_code,
+            record.billing_country
+        ) if part)
+        return primary, billing
     
     def update_last_contact(self):
-        """Update last contact date to current time"""
-        self.last_contact_date = datetime.utcnow()
+        """Update last contact date to current time (set by the database on flush)"""
+        self.last_contact_date = utcnow()
     
     def get_invoice_history(self):
         """Get customer's invoice history with summary statistics"""
         from src.models.invoice import Invoice, InvoiceStatus
         
-        invoices = Invoice.query.filter_by(customer_id=self.id).all()
+        is_paid = Invoice.status == InvoiceStatus.PAID
+        is_overdue = Invoice.status == InvoiceStatus.OVERDUE
+        
+        total_invoices, total_amount, paid_invoices, total_paid, overdue_invoices = self.invoices.with_entities(
+            db.func.count(Invoice.id),
+            db.func.coalesce(db.func.sum(Invoice.total_amount), 0),
+            db.func.coalesce(db.func.sum(db.case((is_paid, 1), else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.case((is_paid, Invoice.total_amount), else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.case((is_overdue, 1), else_=0)), 0)
+        ).one()
         
-        total_invoices = len(invoices)
-        total_amount = sum(invoice.total_amount for invoice in invoices)
-        paid_invoices = [inv for inv in invoices if inv.status == InvoiceStatus.PAID]
-        total_paid = sum(invoice.total_amount for invoice in paid_invoices)
-        overdue_invoices = [inv for inv in invoices if inv.status == InvoiceStatus.OVERDUE]
+        recent_invoices = self.invoices.order_by(Invoice.created_at.desc()).limit(5).all()
         
         return {
             'total_invoices': total_invoices,
             'total_amount': total_amount,
-            'paid_invoices': len(paid_invoices),
+            'paid_invoices': paid_invoices,
             'total_paid': total_paid,
-            'overdue_invoices': len(overdue_invoices),
+            'overdue_invoices': overdue_invoices,
             'outstanding_amount': total_amount - total_paid,
-            'recent_invoices': sorted(invoices, key=lambda x: x.created_at, reverse=True)[:5]
+            'recent_invoices': [invoice.to_dict(include_line_items=False) for invoice in recent_invoices]
         }
     
     def to_dict(self, include_history=False):
         """Convert customer to dictionary"""
-        data = {
-            'id': self.id,
-            'customer_type': self.customer_type.value,
-            'display_name': self.display_name,
-            'first_name': self.first_name,
-            'last_name': self.last_name,
-            'organization_name': self.organization_name,
-            'organization_type': self.organization_type,
-            'tax_id': self.tax_id,
-            'registration_number': self.registration_number,
-            'contact_info': self.get_contact_info(),
+        data = self._serialize(self)
+        
+        if include_history:
+            data['invoice_history'] = self.get_invoice_history()
+        
+        return data
+    
+    @classmethod
+    def serialized_columns(cls):
+        """Get the columns needed to serialize customers without loading ORM objects"""
+        return tuple(getattr(cls, name) for name in cls._SERIALIZED_FIELDS)
+    
+    @classmethod
+    def bulk_to_dict(cls, rows):
+        """Convert rows selected with serialized_columns() to dictionaries"""
+        serialize = cls._serialize
+        return [serialize(row) for row in rows]
+    
+    @classmethod
+    def summary_columns(cls):
+        """Get the columns needed for to_summary_dict"""
+        return tuple(getattr(cls, name) for name in cls._SUMMARY_FIELDS)
+    
+    @classmethod
+    def bulk_to_summary_dict(cls, rows):
+        """Convert rows selected with summary_columns() to short dictionaries"""
+        display_name = cls._display_name
+        return [{
+            'id': row.id,
+            'customer_type': row.customer_type.value,
+            'display_name': display_name(row),
+            'primary_email': row.primary_email,
+            'created_at': row.created_at.isoformat() if row.created_at else None
+        } for row in rows]
+    
+    @staticmethod
+    def _serialize(record):
+        """Convert a customer or a row of customer columns to dictionary"""
+        created_at = record.created_at
+        updated_at = record.updated_at
+        last_contact_date = record.last_contact_date
+        full_address, full_billing_address = Customer._formatted_addresses(record)
+        
+        return {
+            'id': record.id,
+            'customer_type': record.customer_type.value,
+            'display_name': Customer._display_name(record),
+            'first_name': record.first_name,
+            'last_name': record.last_name,
+            'organization_name': record.organization_name,
+            'organization_type': record.organization_type,
+            'tax_id': record.tax_id,
+            'registration_number': record.registration_number,
+            'contact_info': {
+                'primary_email': record.primary_email,
+                'secondary_email': record.secondary_email,
+                'phone_primary': record.phone_primary,
+                'phone_secondary': record.phone_secondary,
+                'website': record.website
+            },
             'address': {
-                'line1': self.address_line1,
-                'line2': self.address_line2,
-                'city': self.city,
-                'state_province': self.state_province,
-                'postal_code': self.postal_code,
-                'country': self.country,
-                'full_address': self.full_address
+                'line1': record.address_line1,
+                'line2': record.address_line2,
+                'city': record.city,
+                'state_province': record.state_province,
+                'postal_code': record.postal_code,
+                'country': record.country,
+                'full_address': full_address
             },
             'billing_address': {
-                'line1': self.billing_address_line1,
-                'line2': self.billing_address_line2,
-                'city': self.billing_city,
-                'state_province': self.billing_state_province,
-                'postal_code': self.billing_postal_code,
-                'country': self.billing_country,
-                'full_address': self.full_billing_address
+                'line1': record.billing_address_line1,
+                'line2': record.billing_address_line2,
+                'city': record.billing_city,
+                'state_province': record.billing_state_province,
+                'postal_code': record.billing_postal_code,
+                'country': record.billing_country,
+                'full_address': full_billing_address
             },
             'preferences': {
-                'currency': self.preferred_currency,
-                'language': self.preferred_language,
-                'payment_terms': self.payment_terms
+                'currency': record.preferred_currency,
+                'language': record.preferred_language,
+                'payment_terms': record.payment_terms
             },
             'notifications': {
-                'email': self.email_notifications,
-                'sms': self.sms_notifications,
-                'whatsapp': self.whatsapp_notifications
+                'email': record.email_notifications,
+                'sms': record.sms_notifications,
+                'whatsapp': record.whatsapp_notifications
             },
-            'is_active': self.is_active,
-            'notes': self.notes,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'last_contact_date': self.last_contact_date.isoformat() if self.last_contact_date else None
+            'is_active': record.is_active,
+            'notes': record.notes,
+            'created_at': created_at.isoformat() if created_at else None,
+            'updated_at': updated_at.isoformat() if updated_at else None,
+            'last_contact_date': last_contact_date.isoformat() if last_contact_date else None
         }
-        
-        if include_history:
-            data['invoice_history'] = self.get_invoice_history()
-        
-        return data
+    
+    @staticmethod
+    def _search_document(columns):
+        """Get the full-text search document for customer names (PostgreSQL)"""
+        return db.func.to_tsvector(
+            SEARCH_CONFIG,
+            db.func.coalesce(columns.first_name, '') + ' ' +
+            db.func.coalesce(columns.last_name, '') + ' ' +
+            db.func.coalesce(columns.organization_name, '')
+        )
+    
+    @staticmethod
+    def _list_search_text(columns):
+        """Get the lowercased name and email text matched by the customer list search"""
+        return db.func.lower(
+            db.func.coalesce(columns.first_name, '') + ' ' +
+            db.func.coalesce(columns.last_name, '') + ' ' +
+            db.func.coalesce(columns.organization_name, '') + ' ' +
+            columns.primary_email
+        )
     
     @classmethod
-    def search(cls, query, customer_type=None, is_active=True):
-        """Search customers by name, email, or organization"""
+    def list_search_filter(cls, search):
+        """Get a filter matching search anywhere in the customer's names or primary email"""
+        return _LIST_SEARCH_TEXT.like(f"%{search.lower()}%")
+    
+    @classmethod
+    def _search_filter(cls, query, customer_type=None, is_active=True):
+        """Build the unordered search query shared by search and search_count"""
         search_filter = cls.query.filter(cls.is_active == is_active)
         
         if customer_type:
             search_filter = search_filter.filter(cls.customer_type == customer_type)
         
         if query:
-            search_term = f"%{query}%"
+            name_filters = []
+            if db.engine.dialect.name == 'postgresql':
+                # Indexed full-text prefix match on names, in any word order
+                words = SEARCH_WORD_RE.findall(query)
+                if words:
+                    name_filters.append(cls._search_document(cls).op('@@')(
+                        db.func.to_tsquery(SEARCH_CONFIG, ' & '.join(f'{word}:*' for word in words))
+                    ))
+            
+            # Substring match on names and primary email through the list
+            # search expression, so both databases and endpoints agree
             search_filter = search_filter.filter(
                 db.or_(
-                    cls.first_name.ilike(search_term),
-                    cls.last_name.ilike(search_term),
-                    cls.organization_name.ilike(search_term),
-                    cls.primary_email.ilike(search_term),
-                    cls.secondary_email.ilike(search_term)
+                    *name_filters,
+                    cls.list_search_filter(query),
+                    cls.secondary_email.ilike(f"%{query}%")
                 )
             )
         
-        return search_filter.order_by(cls.created_at.desc())
+        return search_filter
+    
+    @classmethod
+    def search(cls, query, customer_type=None, is_active=True, after_created_at=None, after_id=None, limit=None):
+        """Search customers by name, email, or organization (newest first)"""
+        search_filter = after_cursor(
+            cls._search_filter(query, customer_type, is_active), cls, after_created_at, after_id
+        )
+        
+        search_filter = search_filter.order_by(cls.created_at.desc(), cls.id.desc())
+        
+        if limit is not None:
+            search_filter = search_filter.limit(limit)
+        
+        return search_filter
+    
+    @classmethod
+    def search_count(cls, query, customer_type=None, is_active=True):
+        """Count search matches, reusing recent counts"""
+        return cls.cached_count(
+            ('search', (query or '').lower(), customer_type, is_active),
+            cls._search_filter(query, customer_type, is_active)
+        )
+    
+    @classmethod
+    def cached_count(cls, key, count_query):
+        """Count a query's rows, reusing the count stored under key for COUNT_CACHE_TTL seconds"""
+        now = time.monotonic()
+        
+        cached = _count_cache.get(key)
+        if cached and now - cached[0] < COUNT_CACHE_TTL:
+            return cached[1]
+        
+        count = count_query.count()
+        
+        if len(_count_cache) >= COUNT_CACHE_SIZE:
+            _count_cache.clear()
+        _count_cache[key] = (now, count)
+        
+        return count
+
+# Case-insensitive uniqueness on PostgreSQL, including rows written outside the ORM
+db.Index('ix_customers_primary_email_lower', db.func.lower(Customer.primary_email), unique=True).ddl_if(dialect='postgresql')
+
+# Full-text index backing Customer.search on PostgreSQL
+db.Index(
+    'ix_customers_search_document',
+    Customer._search_document(Customer.__table__.c),
+    postgresql_using='gin'
+).ddl_if(dialect='postgresql')
+
+# Built once; list_search_filter only adds the LIKE with each request's term
+_LIST_SEARCH_TEXT = Customer._list_search_text(Customer.__table__.c)
+
+# One trigram index backing Customer.list_search_filter on PostgreSQL
+db.Index(
+    'ix_customers_list_search_trgm',
+    _LIST_SEARCH_TEXT.label('list_search_text'),
+    postgresql_using='gin',
+    postgresql_ops={'list_search_text': 'gin_trgm_ops'}
+).ddl_if(dialect='postgresql')
 
+# Trigram indexes need the pg_trgm extension on PostgreSQL
+event.listen(
+    Customer.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
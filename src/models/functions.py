@@ -0,0 +1,22 @@
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import DateTime
+
+class utcnow(FunctionElement):
+    """Current UTC time evaluated by the database, as a naive timestamp"""
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+@compiles(utcnow, 'sqlite')
+def _utcnow_sqlite(element, compiler, **kw):
+    # Match SQLAlchemy's SQLite DateTime storage format so stored values
+    # compare correctly with bound datetime parameters
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f', 'now') || '000')"
@@ -0,0 +1,34 @@
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+# session.info key holding status-history rows queued for the next commit
+PENDING_HISTORY_KEY = 'pending_history'
+
+def queue_history(model, owner, owner_key, **values):
+    """Buffer a history row for a bulk Core INSERT when the session commits
+
+    The owner's primary key is read at commit time, after the flush, so
+    rows can be queued for objects that have not been inserted yet.
+    """
+    from src.models.user import db
+    pending = db.session.info.setdefault(PENDING_HISTORY_KEY, [])
+    pending.append((model, owner, owner_key, values))
+
+@event.listens_for(Session, 'before_commit')
+def _flush_pending_history(session):
+    pending = session.info.pop(PENDING_HISTORY_KEY, None)
+    if not pending:
+        return
+    
+    session.flush()
+    
+    # One executemany INSERT per history table
+    rows_by_model = {}
+    for model, owner, owner_key, values in pending:
+        rows_by_model.setdefault(model, []).append({owner_key: owner.id, **values})
+    for model, rows in rows_by_model.items():
+        session.execute(insert(model), rows)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending_history(session, previous_transaction):
+    session.info.pop(PENDING_HISTORY_KEY, None)
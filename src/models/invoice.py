@@ -1,12 +1,41 @@
 from src.models.user import db
+from src.models.types import EnumName
+from src.models.history import queue_history
 from datetime import datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import DDL, event, insert, inspect, union, update
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from enum import Enum
 import uuid
-import qrcode
-import io
-import base64
+import os
+import re
+import time
 from decimal import Decimal
 
+# Invoice numbers look like INV-YYYY-NNNN; group 1 is the sequence
+INVOICE_NUMBER_RE = re.compile(r'^INV-\d{4}-(\d+)$')
+
+def _uuid7():
+    """Time-ordered UUID (RFC 9562 version 7) so new rows append to the uuid index"""
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | 0x7 << 76
+    value = value & ~(0x3 << 62) | 0x2 << 62
+    return uuid.UUID(int=value)
+
+@lru_cache(maxsize=1024)
+def _payment_qr_png(payment_url):
+    """Render a payment URL as QR code PNG bytes (deterministic, so cached)"""
+    # Imported lazily: only QR rendering paths pay for loading segno
+    import io
+    import segno
+    
+    buffer = io.BytesIO()
+    segno.make(payment_url, error='l', micro=False).save(buffer, kind='png', scale=10, border=4)
+    return buffer.getvalue()
+
 class InvoiceStatus(Enum):
     DRAFT = "draft"
     SENT = "sent"
@@ -14,23 +43,49 @@ class InvoiceStatus(Enum):
     OVERDUE = "overdue"
     CANCELLED = "cancelled"
 
+# Serialized status strings, looked up once per to_dict
+INVOICE_STATUS_VALUES = {status: status.value for status in InvoiceStatus}
+
+# Statuses by their request string, for validating and converting input in one lookup
+INVOICE_STATUS_BY_VALUE = {status.value: status for status in InvoiceStatus}
+
+# Statuses an invoice may move to from each status
+INVOICE_STATUS_TRANSITIONS = {
+    InvoiceStatus.DRAFT: frozenset([InvoiceStatus.SENT, InvoiceStatus.CANCELLED]),
+    InvoiceStatus.SENT: frozenset([InvoiceStatus.PAID, InvoiceStatus.OVERDUE, InvoiceStatus.CANCELLED]),
+    InvoiceStatus.OVERDUE: frozenset([InvoiceStatus.PAID, InvoiceStatus.CANCELLED]),
+    InvoiceStatus.PAID: frozenset(),  # Paid invoices cannot change status
+    InvoiceStatus.CANCELLED: frozenset([InvoiceStatus.DRAFT])  # Can reactivate cancelled invoices
+}
+
 class Invoice(db.Model):
     __tablename__ = 'invoices'
+    __table_args__ = (
+        # Overdue sweeps filter SENT invoices by due date
+        db.Index('ix_invoices_status_due', 'status', 'due_date'),
+        # Newest-first listing and its keyset cursor
+        db.Index('ix_invoices_created', 'created_at', 'id'),
+        # Per-customer listing, and invoices found through a customer search
+        db.Index('ix_invoices_customer_created', 'customer_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     invoice_number = db.Column(db.String(50), unique=True, nullable=False, index=True)
-    uuid = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
+    uuid = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(_uuid7()))
     
     # Customer relationship
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False)
     
     # Project relationship (for foundation-specific invoicing)
-    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=True)
+    # active_history keeps the old value around for the project total_invoiced events
+    project_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=True), active_history=True
+    )
     
     # Invoice details
-    issue_date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date)
+    issue_date = db.Column(db.Date, nullable=False, default=lambda: datetime.utcnow().date())
     due_date = db.Column(db.Date, nullable=False)
-    status = db.Column(db.Enum(InvoiceStatus), nullable=False, default=InvoiceStatus.DRAFT)
+    status = db.Column(EnumName(InvoiceStatus), nullable=False, default=InvoiceStatus.DRAFT)
     
     # Optional reference fields
     reference_number = db.Column(db.String(100))
@@ -44,7 +99,11 @@ class Invoice(db.Model):
     tax_rate = db.Column(db.Numeric(5, 2), default=0)  # Tax rate as percentage
     tax_amount = db.Column(db.Numeric(10, 2), default=0)
     discount_amount = db.Column(db.Numeric(10, 2), default=0)
-    total_amount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    total_amount = db.column_property(
+        db.Column(db.Numeric(10, 2), nullable=False, default=0), active_history=True
+    )
+    # Sum of completed payments, maintained by Payment.update_status
+    total_paid = db.Column(db.Numeric(10, 2), nullable=False, default=0)
     
     # Payment information
     payment_terms = db.Column(db.Integer, default=30)  # Payment terms in days
@@ -67,17 +126,26 @@ class Invoice(db.Model):
     line_items = db.relationship('InvoiceLineItem', backref='invoice', lazy=True, cascade='all, delete-orphan')
     payments = db.relationship('Payment', backref='invoice', lazy=True)
     status_history = db.relationship('InvoiceStatusHistory', backref='invoice', lazy=True, cascade='all, delete-orphan')
+    customer = db.relationship('Customer', back_populates='invoices')
     project = db.relationship('Project', back_populates='invoices')
     
     def __repr__(self):
         return f'<Invoice {self.invoice_number}>'
     
-    @property
+    @hybrid_property
     def is_overdue(self):
         """Check if invoice is overdue"""
         return (self.status in [InvoiceStatus.SENT] and 
                 self.due_date < datetime.utcnow().date())
     
+    @is_overdue.expression
+    def is_overdue(cls):
+        """SQL form of is_overdue, for filtering many invoices in one query"""
+        return db.and_(
+            cls.status == InvoiceStatus.SENT,
+            cls.due_date < datetime.utcnow().date()
+        )
+    
     @property
     def days_until_due(self):
         """Calculate days until due date"""
@@ -91,91 +159,122 @@ class Invoice(db.Model):
         """Generate payment URL for this invoice"""
         return f"/pay/{self.uuid}"
     
-    @property
-    def total_paid(self):
-        """Calculate total amount paid for this invoice"""
+    @classmethod
+    def backfill_total_paid(cls):
+        """Recompute the stored total_paid of every invoice from its completed payments"""
         from src.models.payment import Payment, PaymentStatus
-        paid_payments = Payment.query.filter_by(
-            invoice_id=self.id,
-            status=PaymentStatus.COMPLETED
-        ).all()
-        return sum(payment.amount for payment in paid_payments)
+        paid = db.select(
+            db.func.coalesce(db.func.sum(Payment.amount), 0)
+        ).where(
+            Payment.invoice_id == cls.id,
+            Payment.status == PaymentStatus.COMPLETED
+        ).scalar_subquery()
+        return db.session.execute(update(cls).values(total_paid=paid)).rowcount
+    
+    @staticmethod
+    def _search_text(columns):
+        """Get the lowercased invoice, reference and PO number text matched by the invoice list search"""
+        return db.func.lower(
+            columns.invoice_number + ' ' +
+            db.func.coalesce(columns.reference_number, '') + ' ' +
+            db.func.coalesce(columns.po_number, '')
+        )
+    
+    @classmethod
+    def search_filter(cls, search):
+        """Get a filter matching search in the invoice's numbers or its customer's names and email"""
+        from src.models.customer import Customer
+        
+        # A UNION of ids rather than an OR across the join, so each branch
+        # can use its own trigram index on PostgreSQL
+        by_invoice = db.select(cls.id).where(_SEARCH_TEXT.like(f"%{search.lower()}%"))
+        by_customer = db.select(cls.id).join(Customer, Customer.id == cls.customer_id).where(
+            Customer.list_search_filter(search)
+        )
+        return cls.id.in_(union(by_invoice, by_customer))
+    
+    @classmethod
+    def query_with_children(cls, include_line_items=True, include_payments=False, include_history=False):
+        """Build an invoice query that batch-loads the customer and collections to_dict will serialize"""
+        # to_dict always serializes the customer; join it into the same query
+        query = cls.query.options(joinedload(cls.customer))
+        
+        if include_line_items:
+            query = query.options(selectinload(cls.line_items))
+        if include_payments:
+            query = query.options(selectinload(cls.payments))
+        if include_history:
+            query = query.options(
+                selectinload(cls.status_history).selectinload(InvoiceStatusHistory.changed_by_user)
+            )
+        
+        return query
     
     @property
     def outstanding_amount(self):
         """Calculate outstanding amount"""
-        return self.total_amount - self.total_paid
+        return self.total_amount - (self.total_paid or 0)
     
     def generate_invoice_number(self):
         """Generate unique invoice number"""
-        from datetime import datetime
         year = datetime.utcnow().year
-        
-        # Get the last invoice number for this year
-        last_invoice = Invoice.query.filter(
-            Invoice.invoice_number.like(f'INV-{year}-%')
-        ).order_by(Invoice.invoice_number.desc()).first()
-        
-        if last_invoice:
-            # Extract sequence number and increment
-            try:
-                last_seq = int(last_invoice.invoice_number.split('-')[-1])
-                next_seq = last_seq + 1
-            except (ValueError, IndexError):
-                next_seq = 1
-        else:
-            next_seq = 1
+        next_seq = InvoiceCounter.next_seq(year)
         
         self.invoice_number = f'INV-{year}-{next_seq:04d}'
     
     def calculate_totals(self):
         """Calculate invoice totals based on line items"""
-        self.subtotal = sum(item.total_amount for item in self.line_items)
-        self.tax_amount = (self.subtotal * self.tax_rate / 100) if self.tax_rate else 0
-        self.total_amount = self.subtotal + self.tax_amount - self.discount_amount
+        if self.id is None:
+            # Unsaved invoice: only the in-memory line items exist, and their
+            # generated total_amount is not filled in until they are inserted
+            subtotal = sum(
+                (Decimal(str(item.quantity)) * Decimal(str(item.unit_price)) for item in self.line_items),
+                Decimal('0')
+            )
+        else:
+            subtotal = Decimal(db.session.query(
+                db.func.coalesce(db.func.sum(InvoiceLineItem.total_amount), 0)
+            ).filter(InvoiceLineItem.invoice_id == self.id).scalar())
+        
+        # Request values may still be plain floats/ints until the next load
+        tax_rate = Decimal(str(self.tax_rate or 0))
+        discount_amount = Decimal(str(self.discount_amount or 0))
+        
+        self.subtotal = subtotal
+        self.tax_amount = subtotal * tax_rate / 100
+        self.total_amount = subtotal + self.tax_amount - discount_amount
     
     def update_status(self, new_status, user_id=None, notes=None):
         """Update invoice status and create history record"""
         if self.status != new_status:
             old_status = self.status
             self.status = new_status
+            now = datetime.utcnow()
             
             # Update timestamps based on status
             if new_status == InvoiceStatus.SENT:
-                self.sent_at = datetime.utcnow()
+                self.sent_at = now
             elif new_status == InvoiceStatus.PAID:
-                self.paid_at = datetime.utcnow()
+                self.paid_at = now
             
-            # Create status history record
-            history = InvoiceStatusHistory(
-                invoice_id=self.id,
+            # Queue status history record for a bulk insert at commit
+            queue_history(
+                InvoiceStatusHistory, self, 'invoice_id',
                 old_status=old_status,
                 new_status=new_status,
+                changed_at=now,
                 changed_by=user_id,
                 notes=notes
             )
-            db.session.add(history)
+    
+    def generate_qr_code_png(self, base_url="https://wasatpay.com"):
+        """Generate QR code PNG bytes for payment URL"""
+        return _payment_qr_png(f"{base_url}{self.payment_url}")
     
     def generate_qr_code(self, base_url="https://wasatpay.com"):
-        """Generate QR code for payment URL"""
-        payment_url = f"{base_url}{self.payment_url}"
-        
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(payment_url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to base64 string
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
+        """Generate QR code for payment URL as a data URI"""
+        import base64
+        img_str = base64.b64encode(self.generate_qr_code_png(base_url)).decode()
         return f"data:image/png;base64,{img_str}"
     
     def check_overdue_status(self):
@@ -183,8 +282,38 @@ class Invoice(db.Model):
         if self.is_overdue and self.status == InvoiceStatus.SENT:
             self.update_status(InvoiceStatus.OVERDUE)
     
+    @classmethod
+    def sweep_overdue(cls, user_id=None):
+        """Mark all overdue invoices OVERDUE with one UPDATE and one history INSERT"""
+        overdue_ids = db.session.execute(
+            update(cls)
+            .where(cls.is_overdue)
+            .values(status=InvoiceStatus.OVERDUE)
+            .returning(cls.id)
+        ).scalars().all()
+        
+        if overdue_ids:
+            changed_at = datetime.utcnow()
+            db.session.execute(insert(InvoiceStatusHistory), [
+                {
+                    'invoice_id': invoice_id,
+                    'old_status': InvoiceStatus.SENT,
+                    'new_status': InvoiceStatus.OVERDUE,
+                    'changed_at': changed_at,
+                    'changed_by': user_id,
+                    'notes': 'Marked overdue'
+                }
+                for invoice_id in overdue_ids
+            ])
+        
+        return overdue_ids
+    
     def to_dict(self, include_line_items=True, include_payments=False, include_history=False):
         """Convert invoice to dictionary"""
+        today = datetime.utcnow().date()
+        due_date = self.due_date
+        total_paid = self.total_paid or 0
+        
         data = {
             'id': self.id,
             'invoice_number': self.invoice_number,
@@ -192,27 +321,27 @@ class Invoice(db.Model):
             'customer_id': self.customer_id,
             'customer': self.customer.to_dict() if self.customer else None,
             'issue_date': self.issue_date.isoformat() if self.issue_date else None,
-            'due_date': self.due_date.isoformat() if self.due_date else None,
-            'status': self.status.value,
+            'due_date': due_date.isoformat() if due_date else None,
+            'status': INVOICE_STATUS_VALUES[self.status],
             'reference_number': self.reference_number,
             'po_number': self.po_number,
             'lpo_number': self.lpo_number,
             'delivery_date': self.delivery_date.isoformat() if self.delivery_date else None,
             'currency': self.currency,
-            'subtotal': float(self.subtotal) if self.subtotal else 0,
-            'tax_rate': float(self.tax_rate) if self.tax_rate else 0,
-            'tax_amount': float(self.tax_amount) if self.tax_amount else 0,
-            'discount_amount': float(self.discount_amount) if self.discount_amount else 0,
-            'total_amount': float(self.total_amount) if self.total_amount else 0,
-            'total_paid': float(self.total_paid),
-            'outstanding_amount': float(self.outstanding_amount),
+            'subtotal': float(self.subtotal or 0),
+            'tax_rate': float(self.tax_rate or 0),
+            'tax_amount': float(self.tax_amount or 0),
+            'discount_amount': float(self.discount_amount or 0),
+            'total_amount': float(self.total_amount or 0),
+            'total_paid': float(total_paid),
+            'outstanding_amount': float(self.total_amount - total_paid),
             'payment_terms': self.payment_terms,
             'payment_instructions': self.payment_instructions,
             'payment_url': self.payment_url,
             'notes': self.notes,
             'internal_notes': self.internal_notes,
-            'is_overdue': self.is_overdue,
-            'days_until_due': self.days_until_due,
+            'is_overdue': self.status == InvoiceStatus.SENT and due_date is not None and due_date < today,
+            'days_until_due': (due_date - today).days if due_date else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'sent_at': self.sent_at.isoformat() if self.sent_at else None,
@@ -224,13 +353,117 @@ class Invoice(db.Model):
             data['line_items'] = [item.to_dict() for item in self.line_items]
         
         if include_payments:
-            data['payments'] = [payment.to_dict() for payment in self.payments]
+            from src.models.payment import Payment
+            data['payments'] = [payment.to_dict() for payment in Payment.preload_refunds(self.payments)]
         
         if include_history:
             data['status_history'] = [history.to_dict() for history in self.status_history]
         
         return data
 
+# Keep Project.total_invoiced in step with invoice amounts, in the same flush
+@event.listens_for(Invoice, 'after_insert')
+def _add_to_project_total(mapper, connection, target):
+    if target.project_id is not None and target.total_amount:
+        from src.models.project import Project
+        Project.adjust_total_invoiced(connection, target.project_id, target.total_amount)
+
+@event.listens_for(Invoice, 'after_update')
+def _move_project_total(mapper, connection, target):
+    state = inspect(target)
+    project_history = state.attrs.project_id.history
+    amount_history = state.attrs.total_amount.history
+    if not project_history.has_changes() and not amount_history.has_changes():
+        return
+    
+    from src.models.project import Project
+    new_project, new_amount = target.project_id, target.total_amount or 0
+    old_project = project_history.deleted[0] if project_history.deleted else new_project
+    old_amount = (amount_history.deleted[0] if amount_history.deleted else new_amount) or 0
+    
+    if old_project == new_project:
+        if new_project is not None and new_amount != old_amount:
+            Project.adjust_total_invoiced(connection, new_project, new_amount - old_amount)
+        return
+    if old_project is not None and old_amount:
+        Project.adjust_total_invoiced(connection, old_project, -old_amount)
+    if new_project is not None and new_amount:
+        Project.adjust_total_invoiced(connection, new_project, new_amount)
+
+@event.listens_for(Invoice, 'before_delete')
+def _remove_from_project_total(mapper, connection, target):
+    if target.project_id is not None and target.total_amount:
+        from src.models.project import Project
+        Project.adjust_total_invoiced(connection, target.project_id, -target.total_amount)
+
+# Built once; search_filter only adds the LIKE with each request's term
+_SEARCH_TEXT = Invoice._search_text(Invoice.__table__.c)
+
+# Trigram index backing the invoice side of Invoice.search_filter on PostgreSQL
+db.Index(
+    'ix_invoices_search_trgm',
+    _SEARCH_TEXT.label('search_text'),
+    postgresql_using='gin',
+    postgresql_ops={'search_text': 'gin_trgm_ops'}
+).ddl_if(dialect='postgresql')
+
+# Trigram indexes need the pg_trgm extension on PostgreSQL
+event.listen(
+    Invoice.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+class InvoiceCounter(db.Model):
+    __tablename__ = 'invoice_counters'
+    
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<InvoiceCounter {self.year}: {self.last_seq}>'
+    
+    @classmethod
+    def next_seq(cls, year):
+        """Atomically increment and return the invoice sequence for a year"""
+        counters = cls.__table__
+        
+        next_seq = db.session.execute(
+            update(counters)
+            .where(counters.c.year == year)
+            .values(last_seq=counters.c.last_seq + 1)
+            .returning(counters.c.last_seq)
+        ).scalar()
+        
+        if next_seq is None:
+            # First number this year: continue after any invoices issued before the counter existed
+            insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+            next_seq = db.session.execute(
+                insert(counters)
+                .values(year=year, last_seq=cls._last_issued_seq(year) + 1)
+                .on_conflict_do_update(
+                    index_elements=[counters.c.year],
+                    set_={'last_seq': counters.c.last_seq + 1}
+                )
+                .returning(counters.c.last_seq)
+            ).scalar()
+        
+        return next_seq
+    
+    @staticmethod
+    def _last_issued_seq(year):
+        """Get the highest existing invoice sequence for a year"""
+        # Numbers are zero-padded to four digits, so order by length first
+        last_number = db.session.query(Invoice.invoice_number).filter(
+            Invoice.invoice_number.like(f'INV-{year}-%')
+        ).order_by(
+            db.func.length(Invoice.invoice_number).desc(),
+            Invoice.invoice_number.desc()
+        ).limit(1).scalar()
+        
+        match = INVOICE_NUMBER_RE.match(last_number) if last_number else None
+        return int(match.group(1)) if match else 0
+
 class InvoiceLineItem(db.Model):
     __tablename__ = 'invoice_line_items'
     
@@ -241,7 +474,8 @@ class InvoiceLineItem(db.Model):
     description = db.Column(db.String(500), nullable=False)
     quantity = db.Column(db.Numeric(10, 2), nullable=False, default=1)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
-    total_amount = db.Column(db.Numeric(10, 2), nullable=False)
+    # Maintained by the database from quantity and unit_price
+    total_amount = db.Column(db.Numeric(10, 2), db.Computed('quantity * unit_price', persisted=True))
     
     # Optional fields
     unit_of_measure = db.Column(db.String(20))  # e.g., "hours", "pieces", "kg"
@@ -254,18 +488,14 @@ class InvoiceLineItem(db.Model):
     def __repr__(self):
         return f'<InvoiceLineItem {self.description[:50]}>'
     
-    def calculate_total(self):
-        """Calculate total amount for this line item"""
-        self.total_amount = self.quantity * self.unit_price
-    
     def to_dict(self):
         """Convert line item to dictionary"""
         return {
             'id': self.id,
             'description': self.description,
-            'quantity': float(self.quantity) if self.quantity else 0,
-            'unit_price': float(self.unit_price) if self.unit_price else 0,
-            'total_amount': float(self.total_amount) if self.total_amount else 0,
+            'quantity': float(self.quantity or 0),
+            'unit_price': float(self.unit_price or 0),
+            'total_amount': float(self.total_amount or 0),
             'unit_of_measure': self.unit_of_measure,
             'product_code': self.product_code,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -279,8 +509,8 @@ class InvoiceStatusHistory(db.Model):
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
     
     # Status change details
-    old_status = db.Column(db.Enum(InvoiceStatus), nullable=False)
-    new_status = db.Column(db.Enum(InvoiceStatus), nullable=False)
+    old_status = db.Column(EnumName(InvoiceStatus), nullable=False)
+    new_status = db.Column(EnumName(InvoiceStatus), nullable=False)
     changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     changed_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     notes = db.Column(db.Text)
@@ -295,8 +525,8 @@ class InvoiceStatusHistory(db.Model):
         """Convert status history to dictionary"""
         return {
             'id': self.id,
-            'old_status': self.old_status.value,
-            'new_status': self.new_status.value,
+            'old_status': INVOICE_STATUS_VALUES[self.old_status],
+            'new_status': INVOICE_STATUS_VALUES[self.new_status],
             'changed_at': self.changed_at.isoformat() if self.changed_at else None,
             'changed_by': self.changed_by,
             'changed_by_user': self.changed_by_user.to_dict() if self.changed_by_user else None,
@@ -1,4 +1,6 @@
 from src.models.user import db
+from src.models.types import EnumName
+from src.models.history import queue_history
 from datetime import datetime
 from enum import Enum
 from decimal import Decimal
@@ -23,8 +25,19 @@ class PaymentProvider(Enum):
     FLUTTERWAVE = "flutterwave"
     MANUAL = "manual"
 
+# Serialized enum strings, looked up once per to_dict
+PAYMENT_STATUS_VALUES = {status: status.value for status in PaymentStatus}
+PAYMENT_METHOD_VALUES = {method: method.value for method in PaymentMethod}
+PAYMENT_PROVIDER_VALUES = {provider: provider.value for provider in PaymentProvider}
+
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        # Per-invoice payment lookups and Invoice.backfill_total_paid
+        db.Index('ix_payments_invoice_status', 'invoice_id', 'status'),
+        # Status filters on listings and stats
+        db.Index('ix_payments_status', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
@@ -32,9 +45,9 @@ class Payment(db.Model):
     # Payment details
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     currency = db.Column(db.String(3), nullable=False, default='USD')
-    status = db.Column(db.Enum(PaymentStatus), nullable=False, default=PaymentStatus.PENDING)
-    method = db.Column(db.Enum(PaymentMethod), nullable=False)
-    provider = db.Column(db.Enum(PaymentProvider), nullable=False)
+    status = db.Column(EnumName(PaymentStatus), nullable=False, default=PaymentStatus.PENDING)
+    method = db.Column(EnumName(PaymentMethod), nullable=False)
+    provider = db.Column(EnumName(PaymentProvider), nullable=False)
     
     # Provider-specific information
     provider_transaction_id = db.Column(db.String(100), index=True)
@@ -100,7 +113,35 @@ class Payment(db.Model):
     @property
     def total_refunded(self):
         """Calculate total amount refunded"""
-        return sum(refund.amount for refund in self.refunds if refund.status == PaymentStatus.COMPLETED)
+        cached = self.__dict__.get('_total_refunded_cache')
+        if cached is not None:
+            return cached
+        
+        return db.session.query(
+            db.func.coalesce(db.func.sum(PaymentRefund.amount), 0)
+        ).filter(
+            PaymentRefund.payment_id == self.id,
+            PaymentRefund.status == PaymentStatus.COMPLETED
+        ).scalar()
+    
+    @classmethod
+    def preload_refunds(cls, payments):
+        """Load total_refunded for many payments with a single grouped query"""
+        ids = [payment.id for payment in payments]
+        if not ids:
+            return payments
+        
+        totals = dict(db.session.query(
+            PaymentRefund.payment_id,
+            db.func.sum(PaymentRefund.amount)
+        ).filter(
+            PaymentRefund.payment_id.in_(ids),
+            PaymentRefund.status == PaymentStatus.COMPLETED
+        ).group_by(PaymentRefund.payment_id).all())
+        
+        for payment in payments:
+            payment._total_refunded_cache = totals.get(payment.id, 0)
+        return payments
     
     @property
     def refundable_amount(self):
@@ -116,29 +157,48 @@ class Payment(db.Model):
         old_status = self.status
         self.status = new_status
         
+        from src.models.invoice import Invoice, InvoiceStatus
+        
+        # Load the parent invoice once, without flushing the pending status
+        # change first; its stored total_paid makes the paid check a column read
+        with db.session.no_autoflush:
+            invoice = self.invoice
+            delta = 0
+            if old_status != new_status:
+                if new_status == PaymentStatus.COMPLETED:
+                    delta = self.amount
+                elif old_status == PaymentStatus.COMPLETED:
+                    delta = -self.amount
+        
+        # Adjust the stored total in SQL so concurrent payments on the same
+        # invoice can't overwrite each other, then read back the result
+        if delta:
+            invoice.total_paid = Invoice.total_paid + delta
+            db.session.flush()
+            db.session.refresh(invoice, ['total_paid'])
+        
         # Update timestamps based on status
         if new_status == PaymentStatus.PROCESSING:
             self.processed_at = datetime.utcnow()
         elif new_status == PaymentStatus.COMPLETED:
             self.completed_at = datetime.utcnow()
             # Update invoice status if fully paid
-            if self.invoice.outstanding_amount <= 0:
-                from src.models.invoice import InvoiceStatus
-                self.invoice.update_status(InvoiceStatus.PAID)
+            if invoice.outstanding_amount <= 0:
+                invoice.update_status(InvoiceStatus.PAID)
         elif new_status == PaymentStatus.FAILED:
             self.failed_at = datetime.utcnow()
             self.failure_reason = failure_reason
             self.failure_code = failure_code
         
-        # Create payment history record
-        history = PaymentHistory(
-            payment_id=self.id,
+        # Queue payment history record for a bulk insert at commit
+        queue_history(
+            PaymentHistory, self, 'payment_id',
             old_status=old_status,
             new_status=new_status,
+            changed_at=datetime.utcnow(),
             failure_reason=failure_reason,
             failure_code=failure_code
         )
-        db.session.add(history)
     
     def create_refund(self, amount, reason=None, user_id=None):
         """Create a refund for this payment"""
@@ -161,22 +221,24 @@ class Payment(db.Model):
     
     def to_dict(self, include_sensitive=False):
         """Convert payment to dictionary"""
+        total_refunded = self.total_refunded
+        
         data = {
             'id': self.id,
             'invoice_id': self.invoice_id,
-            'amount': float(self.amount) if self.amount else 0,
+            'amount': float(self.amount or 0),
             'currency': self.currency,
-            'status': self.status.value,
-            'method': self.method.value,
-            'provider': self.provider.value,
+            'status': PAYMENT_STATUS_VALUES[self.status],
+            'method': PAYMENT_METHOD_VALUES[self.method],
+            'provider': PAYMENT_PROVIDER_VALUES[self.provider],
             'description': self.description,
             'reference_number': self.reference_number,
             'customer_email': self.customer_email,
             'customer_name': self.customer_name,
-            'processing_fee': float(self.processing_fee) if self.processing_fee else 0,
-            'net_amount': float(self.net_amount) if self.net_amount else 0,
-            'total_refunded': float(self.total_refunded),
-            'refundable_amount': float(self.refundable_amount),
+            'processing_fee': float(self.processing_fee or 0),
+            'net_amount': float(self.net_amount or 0),
+            'total_refunded': float(total_refunded),
+            'refundable_amount': float(self.amount - total_refunded),
             'is_successful': self.is_successful,
             'is_refundable': self.is_refundable,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -220,6 +282,10 @@ class Payment(db.Model):
 
 class PaymentRefund(db.Model):
     __tablename__ = 'payment_refunds'
+    __table_args__ = (
+        # Payment.total_refunded / preload_refunds
+        db.Index('ix_refunds_payment_status', 'payment_id', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     payment_id = db.Column(db.Integer, db.ForeignKey('payments.id'), nullable=False)
@@ -227,7 +293,7 @@ class PaymentRefund(db.Model):
     # Refund details
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     reason = db.Column(db.String(500))
-    status = db.Column(db.Enum(PaymentStatus), nullable=False, default=PaymentStatus.PENDING)
+    status = db.Column(EnumName(PaymentStatus), nullable=False, default=PaymentStatus.PENDING)
     
     # Provider information
     provider_refund_id = db.Column(db.String(100))
@@ -253,9 +319,9 @@ class PaymentRefund(db.Model):
         return {
             'id': self.id,
             'payment_id': self.payment_id,
-            'amount': float(self.amount) if self.amount else 0,
+            'amount': float(self.amount or 0),
             'reason': self.reason,
-            'status': self.status.value,
+            'status': PAYMENT_STATUS_VALUES[self.status],
             'provider_refund_id': self.provider_refund_id,
             'requested_by': self.requested_by,
             'processed_by': self.processed_by,
@@ -271,8 +337,8 @@ class PaymentHistory(db.Model):
     payment_id = db.Column(db.Integer, db.ForeignKey('payments.id'), nullable=False)
     
     # Status change details
-    old_status = db.Column(db.Enum(PaymentStatus), nullable=False)
-    new_status = db.Column(db.Enum(PaymentStatus), nullable=False)
+    old_status = db.Column(EnumName(PaymentStatus), nullable=False)
+    new_status = db.Column(EnumName(PaymentStatus), nullable=False)
     changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
     # Error information
@@ -289,8 +355,8 @@ class PaymentHistory(db.Model):
         """Convert payment history to dictionary"""
         return {
             'id': self.id,
-            'old_status': self.old_status.value,
-            'new_status': self.new_status.value,
+            'old_status': PAYMENT_STATUS_VALUES[self.old_status],
+            'new_status': PAYMENT_STATUS_VALUES[self.new_status],
             'changed_at': self.changed_at.isoformat() if self.changed_at else None,
             'failure_reason': self.failure_reason,
             'failure_code': self.failure_code
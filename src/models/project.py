@@ -1,9 +1,20 @@
 from src.models.user import db
+from src.models.functions import utcnow
+from src.models.types import EnumName
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 import uuid
+import re
 from enum import Enum
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import bindparam, update
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# Project codes look like WHF-YYYY-NNN; group 1 is the sequence
+PROJECT_CODE_RE = re.compile(r'^WHF-\d{4}-(\d+)$')
 
 class ProjectStatus(Enum):
     PLANNING = "planning"
@@ -18,9 +29,20 @@ class FundingType(Enum):
     CONTRACT = "contract"
     PARTNERSHIP = "partnership"
 
+# Serialized enum strings, looked up once per to_dict
+PROJECT_STATUS_VALUES = {status: status.value for status in ProjectStatus}
+FUNDING_TYPE_VALUES = {funding_type: funding_type.value for funding_type in FundingType}
+FUNDING_TYPE_VALUES[None] = None
+
 class Project(db.Model):
     """Model for foundation projects and programs"""
     __tablename__ = 'projects'
+    __table_args__ = (
+        # Project listing: active flag filter, newest first
+        db.Index('ix_projects_active_created', 'is_active', 'created_at'),
+        # Status-filtered listings and stats
+        db.Index('ix_projects_status_active', 'status', 'is_active'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
@@ -33,7 +55,7 @@ class Project(db.Model):
     # Project Details
     start_date = db.Column(db.DateTime)
     end_date = db.Column(db.DateTime)
-    status = db.Column(SQLEnum(ProjectStatus), default=ProjectStatus.PLANNING, nullable=False)
+    status = db.Column(EnumName(ProjectStatus), default=ProjectStatus.PLANNING, nullable=False)
     
     # Location Information
     country = db.Column(db.String(100), default='Kenya')
@@ -42,9 +64,10 @@ class Project(db.Model):
     specific_location = db.Column(db.String(200))
     
     # Financial Information
-    total_budget = db.Column(db.Numeric(15, 2))
+    total_budget_cents = db.Column(db.BigInteger)  # Whole cents, converted at the edge
+    total_invoiced = db.Column(db.Numeric(15, 2), nullable=False, default=0)  # Kept in step by invoice flush events
     currency = db.Column(db.String(3), default='USD')
-    funding_type = db.Column(SQLEnum(FundingType), default=FundingType.GRANT)
+    funding_type = db.Column(EnumName(FundingType), default=FundingType.GRANT)
     
     # Beneficiary Information
     target_beneficiaries = db.Column(db.Integer)
@@ -64,8 +87,8 @@ class Project(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=utcnow(), nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=utcnow(), onupdate=utcnow(), nullable=False)
     
     # Status tracking
     is_active = db.Column(db.Boolean, default=True, nullable=False)
@@ -73,7 +96,7 @@ class Project(db.Model):
     # Relationships
     project_manager = relationship('User', foreign_keys=[project_manager_id], backref='managed_projects')
     creator = relationship('User', foreign_keys=[created_by], backref='created_projects')
-    invoices = relationship('Invoice', back_populates='project', lazy='dynamic')
+    invoices = relationship('Invoice', back_populates='project', lazy='select')
     
     def __init__(self, **kwargs):
         super(Project, self).__init__(**kwargs)
@@ -83,26 +106,27 @@ class Project(db.Model):
     def generate_project_code(self):
         """Generate unique project code"""
         year = datetime.now().year
-        # Get count of projects this year
-        year_count = Project.query.filter(
-            Project.created_at >= datetime(year, 1, 1),
-            Project.created_at < datetime(year + 1, 1, 1)
-        ).count() + 1
+        next_seq = ProjectCounter.next_seq(year)
         
         # Format: WHF-YYYY-NNN (Wasat Humanitarian Foundation)
-        self.project_code = f"WHF-{year}-{year_count:03d}"
+        self.project_code = f"WHF-{year}-{next_seq:03d}"
     
     def to_dict(self, include_invoices=False, include_financial=True):
         """Convert project to dictionary"""
+        start_date = self.start_date
+        end_date = self.end_date
+        funding_type = FUNDING_TYPE_VALUES[self.funding_type]
+        project_manager = self.project_manager
+        
         data = {
             'id': self.id,
             'uuid': self.uuid,
             'project_name': self.project_name,
             'project_code': self.project_code,
             'description': self.description,
-            'start_date': self.start_date.isoformat() if self.start_date else None,
-            'end_date': self.end_date.isoformat() if self.end_date else None,
-            'status': self.status.value,
+            'start_date': start_date.isoformat() if start_date else None,
+            'end_date': end_date.isoformat() if end_date else None,
+            'status': PROJECT_STATUS_VALUES[self.status],
             'location': {
                 'country': self.country,
                 'region': self.region,
@@ -119,12 +143,12 @@ class Project(db.Model):
                 'primary_donor': self.primary_donor,
                 'donor_reference': self.donor_reference,
                 'grant_agreement_number': self.grant_agreement_number,
-                'funding_type': self.funding_type.value if self.funding_type else None
+                'funding_type': funding_type
             },
             'project_manager': {
-                'id': self.project_manager.id,
-                'name': f"{self.project_manager.first_name} {self.project_manager.last_name}"
-            } if self.project_manager else None,
+                'id': project_manager.id,
+                'name': f"{project_manager.first_name} {project_manager.last_name}"
+            } if project_manager else None,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
             'is_active': self.is_active
@@ -132,9 +156,10 @@ class Project(db.Model):
         
         if include_financial:
             data['financial'] = {
-                'total_budget': float(self.total_budget) if self.total_budget else 0,
+                'total_budget': self.total_budget or 0.0,
+                'total_invoiced': self.get_total_invoiced(),
                 'currency': self.currency,
-                'funding_type': self.funding_type.value if self.funding_type else None
+                'funding_type': funding_type
             }
         
         if include_invoices:
@@ -142,35 +167,85 @@ class Project(db.Model):
         
         return data
     
+    @hybrid_property
+    def total_budget(self):
+        """Total budget in currency units"""
+        if self.total_budget_cents is None:
+            return None
+        return self.total_budget_cents / 100
+    
+    @total_budget.setter
+    def total_budget(self, value):
+        if value is None or value == '':
+            self.total_budget_cents = None
+        else:
+            self.total_budget_cents = int((Decimal(str(value)) * 100).to_integral_value(ROUND_HALF_UP))
+    
+    @total_budget.expression
+    def total_budget(cls):
+        """SQL form of total_budget, for aggregates"""
+        return cls.total_budget_cents / 100.0
+    
     def get_total_invoiced(self):
         """Get total amount invoiced for this project"""
+        return float(self.total_invoiced or 0)
+    
+    @classmethod
+    def adjust_total_invoiced(cls, connection, project_id, delta):
+        """Add an invoice amount change to a project's stored total from inside a flush"""
+        connection.execute(_BUMP_TOTAL_INVOICED, {'invoiced_project_id': project_id, 'delta': delta})
+    
+    @classmethod
+    def backfill_total_invoiced(cls):
+        """Recompute the stored total_invoiced of every project from its invoices"""
         from src.models.invoice import Invoice
-        total = db.session.query(db.func.sum(Invoice.total_amount)).filter_by(
-            project_id=self.id
-        ).scalar()
-        return float(total) if total else 0.0
+        invoiced = db.select(
+            db.func.coalesce(db.func.sum(Invoice.total_amount), 0)
+        ).where(Invoice.project_id == cls.id).scalar_subquery()
+        return db.session.execute(
+            update(cls).values(total_invoiced=invoiced, updated_at=cls.updated_at)
+        ).rowcount
     
     def get_budget_utilization(self):
         """Get budget utilization percentage"""
-        if not self.total_budget or self.total_budget == 0:
+        if not self.total_budget_cents:
             return 0.0
         
         total_invoiced = self.get_total_invoiced()
-        return (total_invoiced / float(self.total_budget)) * 100
+        return (total_invoiced / self.total_budget) * 100
     
     def is_budget_exceeded(self):
         """Check if project budget is exceeded"""
-        if not self.total_budget:
+        if not self.total_budget_cents:
             return False
         
-        return self.get_total_invoiced() > float(self.total_budget)
+        return self.get_total_invoiced() > self.total_budget
     
     def get_remaining_budget(self):
         """Get remaining budget amount"""
-        if not self.total_budget:
+        if not self.total_budget_cents:
             return 0.0
         
-        return float(self.total_budget) - self.get_total_invoiced()
+        return self.total_budget - self.get_total_invoiced()
+    
+    def get_budget_summary(self):
+        """Get total invoiced, utilization, remaining budget and overrun in one pass"""
+        total_invoiced = self.get_total_invoiced()
+        total_budget = self.total_budget
+        if not total_budget:
+            return {
+                'total_invoiced': total_invoiced,
+                'budget_utilization': 0.0,
+                'remaining_budget': 0.0,
+                'is_budget_exceeded': False
+            }
+        
+        return {
+            'total_invoiced': total_invoiced,
+            'budget_utilization': (total_invoiced / total_budget) * 100,
+            'remaining_budget': total_budget - total_invoiced,
+            'is_budget_exceeded': total_invoiced > total_budget
+        }
     
     def update_beneficiary_count(self, direct=None, indirect=None):
         """Update beneficiary counts"""
@@ -187,6 +262,70 @@ class Project(db.Model):
     def __repr__(self):
         return f'<Project {self.project_code}: {self.project_name}>'
 
+# Built once at import; leaves updated_at alone since the project itself did not change
+_BUMP_TOTAL_INVOICED = (
+    update(Project.__table__)
+    .where(Project.__table__.c.id == bindparam('invoiced_project_id'))
+    .values(
+        total_invoiced=Project.__table__.c.total_invoiced + bindparam('delta'),
+        updated_at=Project.__table__.c.updated_at
+    )
+)
+
+class ProjectCounter(db.Model):
+    __tablename__ = 'project_counters'
+    
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ProjectCounter {self.year}: {self.last_seq}>'
+    
+    @classmethod
+    def next_seq(cls, year):
+        """Atomically increment and return the project sequence for a year"""
+        counters = cls.__table__
+        
+        # Common case: this year's row exists and one prebuilt UPDATE ... RETURNING bumps it
+        next_seq = db.session.execute(_BUMP_PROJECT_COUNTER, {'counter_year': year}).scalar()
+        
+        if next_seq is None:
+            # First code this year: continue after any projects created before the counter existed
+            insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+            next_seq = db.session.execute(
+                insert(counters)
+                .values(year=year, last_seq=cls._last_issued_seq(year) + 1)
+                .on_conflict_do_update(
+                    index_elements=[counters.c.year],
+                    set_={'last_seq': counters.c.last_seq + 1}
+                )
+                .returning(counters.c.last_seq)
+            ).scalar()
+        
+        return next_seq
+    
+    @staticmethod
+    def _last_issued_seq(year):
+        """Get the highest existing project code sequence for a year"""
+        # Codes are zero-padded to three digits, so order by length first
+        last_code = db.session.query(Project.project_code).filter(
+            Project.project_code.like(f'WHF-{year}-%')
+        ).order_by(
+            db.func.length(Project.project_code).desc(),
+            Project.project_code.desc()
+        ).limit(1).scalar()
+        
+        match = PROJECT_CODE_RE.match(last_code) if last_code else None
+        return int(match.group(1)) if match else 0
+
+# Built once at import; only the year varies between calls
+_BUMP_PROJECT_COUNTER = (
+    update(ProjectCounter.__table__)
+    .where(ProjectCounter.__table__.c.year == bindparam('counter_year'))
+    .values(last_seq=ProjectCounter.__table__.c.last_seq + 1)
+    .returning(ProjectCounter.__table__.c.last_seq)
+)
+
 class ProjectMilestone(db.Model):
     """Model for project milestones and deliverables"""
     __tablename__ = 'project_milestones'
@@ -209,8 +348,8 @@ class ProjectMilestone(db.Model):
     completion_percentage = db.Column(db.Integer, default=0)
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=utcnow(), nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=utcnow(), onupdate=utcnow(), nullable=False)
     
     # Relationships
     project = relationship('Project', backref='milestones')
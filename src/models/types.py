@@ -0,0 +1,31 @@
+from sqlalchemy.types import String, TypeDecorator
+
+class EnumName(TypeDecorator):
+    """Python Enum stored as its member name in a plain VARCHAR column
+
+    Stores the same strings as db.Enum, so existing rows read back unchanged,
+    but skips the database ENUM/CHECK type and Enum's per-row coercion.
+    Binds accept a member, its name or its value.
+    """
+    
+    impl = String
+    cache_ok = True
+    
+    def __init__(self, enum_class, length=20):
+        super().__init__(length)
+        self.enum_class = enum_class
+        self._members = enum_class.__members__
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, self.enum_class):
+            return value.name
+        if value in self._members:
+            return value
+        return self.enum_class(value).name
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._members[value]
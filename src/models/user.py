@@ -1,15 +1,53 @@
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import load_only, validates
+from src.models.functions import utcnow
+from src.models.types import EnumName
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from datetime import datetime
+from functools import lru_cache
 import jwt
+import threading
+import time
+import uuid
 from enum import Enum
 
 db = SQLAlchemy()
 
+# argon2id hasher for new passwords; older Werkzeug hashes are upgraded on login
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+
+@lru_cache(maxsize=4096)
+def _decode_jwt(token, secret_key):
+    """Verify a token's signature and decode it; expiry is checked per use"""
+    return jwt.decode(token, secret_key, algorithms=['HS256'], options={'verify_exp': False})
+
+# Revoked token IDs seen by this process (jti -> exp), so a logged-out token
+# is refused without asking the database again; revoked_tokens is shared
+_revoked_jtis = {}
+_revoked_jtis_lock = threading.Lock()
+REVOKED_JTIS_MAX = 10000
+
+def _remember_revoked(jti, exp):
+    """Add a revoked jti to the local map, dropping expired entries when full"""
+    with _revoked_jtis_lock:
+        if len(_revoked_jtis) >= REVOKED_JTIS_MAX:
+            now = time.time()
+            for key in [key for key, key_exp in _revoked_jtis.items() if key_exp <= now]:
+                del _revoked_jtis[key]
+            # Still full of live tokens: evict the oldest entry
+            if len(_revoked_jtis) >= REVOKED_JTIS_MAX:
+                del _revoked_jtis[next(iter(_revoked_jtis))]
+        _revoked_jtis[jti] = exp
+
 class UserRole(Enum):
     ADMIN = "admin"
     STAFF = "staff"
 
+# Serialized role strings, looked up once per to_dict / token
+USER_ROLE_VALUES = {role: role.value for role in UserRole}
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -18,12 +56,12 @@ class User(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
-    role = db.Column(db.Enum(UserRole), nullable=False, default=UserRole.STAFF)
+    role = db.Column(EnumName(UserRole), nullable=False, default=UserRole.STAFF)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=utcnow(), nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=utcnow(), onupdate=utcnow(), nullable=False)
     last_login = db.Column(db.DateTime)
     
     # Security fields
@@ -37,14 +75,33 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.email}>'
     
+    @validates('email')
+    def normalize_email(self, key, email):
+        """Store emails lowercased and stripped so lookups hit the unique index"""
+        return email.strip().lower() if email else email
+    
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
         self.password_changed_at = datetime.utcnow()
     
     def check_password(self, password):
         """Check if provided password matches hash"""
-        return check_password_hash(self.password_hash, password)
+        if not self.password_hash.startswith('$argon2'):
+            # Legacy Werkzeug PBKDF2/scrypt hash: rehash as argon2id once it verifies
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.password_hash = password_hasher.hash(password)
+            return True
+        
+        try:
+            password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        
+        if password_hasher.check_needs_rehash(self.password_hash):
+            self.password_hash = password_hasher.hash(password)
+        return True
     
     def is_admin(self):
         """Check if user has admin role"""
@@ -84,12 +141,14 @@ class User(db.Model):
     
     def generate_jwt_token(self, secret_key, expires_in=3600):
         """Generate JWT token for authentication"""
+        now = int(time.time())
         payload = {
             'user_id': self.id,
             'email': self.email,
-            'role': self.role.value,
-            'exp': datetime.utcnow().timestamp() + expires_in,
-            'iat': datetime.utcnow().timestamp()
+            'role': USER_ROLE_VALUES[self.role],
+            'exp': now + expires_in,
+            'iat': now,
+            'jti': uuid.uuid4().hex
         }
         return jwt.encode(payload, secret_key, algorithm='HS256')
     
@@ -97,16 +156,56 @@ class User(db.Model):
     def verify_jwt_token(token, secret_key):
         """Verify JWT token and return user"""
         try:
-            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
-            user = User.query.get(payload['user_id'])
-            if user and user.is_active and not user.is_account_locked():
+            # Decoding is cached per token; the user row is still loaded on
+            # every call so deactivation and locks apply immediately
+            payload = _decode_jwt(token, secret_key)
+            if payload['exp'] <= time.time():
+                return None
+            jti = payload.get('jti')
+            if jti in _revoked_jtis:
+                return None
+            
+            # Revocation is checked in the same query as the user load, which
+            # only fetches the columns the checks and most routes need
+            revoked = db.session.query(RevokedToken.jti).filter_by(jti=jti).exists()
+            row = (db.session.query(User, revoked)
+                   .options(load_only(User.id, User.email, User.role, User.is_active, User.account_locked_until))
+                   .filter(User.id == payload['user_id'])
+                   .one_or_none())
+            if row is None:
+                return None
+            user, is_revoked = row
+            if is_revoked:
+                _remember_revoked(jti, payload['exp'])
+                return None
+            if user.is_active and not user.is_account_locked():
                 return user
-        except jwt.ExpiredSignatureError:
-            return None
         except jwt.InvalidTokenError:
             return None
         return None
     
+    @staticmethod
+    def revoke_jwt_token(token, secret_key):
+        """Revoke a token until it expires; returns False if it cannot be revoked"""
+        try:
+            payload = _decode_jwt(token, secret_key)
+        except jwt.InvalidTokenError:
+            return False
+        jti = payload.get('jti')
+        if not jti:
+            return False
+        
+        now = int(time.time())
+        if payload['exp'] <= now:
+            return True
+        
+        # Expired entries can never match a live token, so prune them here
+        RevokedToken.query.filter(RevokedToken.expires_at <= now).delete(synchronize_session=False)
+        if not db.session.get(RevokedToken, jti):
+            db.session.add(RevokedToken(jti=jti, expires_at=payload['exp']))
+        _remember_revoked(jti, payload['exp'])
+        return True
+    
     def to_dict(self, include_sensitive=False):
         """Convert user to dictionary"""
         data = {
@@ -115,7 +214,7 @@ class User(db.Model):
             'first_name': self.first_name,
             'last_name': self.last_name,
             'full_name': f"{self.first_name} {self.last_name}",
-            'role': self.role.value,
+            'role': USER_ROLE_VALUES[self.role],
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
@@ -131,3 +230,14 @@ class User(db.Model):
         
         return data
 
+# Case-insensitive uniqueness on PostgreSQL, including rows written outside the ORM
+db.Index('ix_users_email_lower', db.func.lower(User.email), unique=True).ddl_if(dialect='postgresql')
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    
+    jti = db.Column(db.String(32), primary_key=True)
+    expires_at = db.Column(db.Integer, nullable=False, index=True)  # Token exp, epoch seconds
+    
+    def __repr__(self):
+        return f'<RevokedToken {self.jti}>'
@@ -0,0 +1,27 @@
+from datetime import datetime
+from flask import request
+from sqlalchemy import tuple_
+
+def cursor_args():
+    """Read the after_created_at / after_id keyset cursor from the query string; raises ValueError"""
+    after_created_at = request.args.get('after_created_at')
+    if after_created_at:
+        after_created_at = datetime.fromisoformat(after_created_at)
+    return after_created_at or None, request.args.get('after_id', type=int)
+
+def after_cursor(query, model, after_created_at=None, after_id=None):
+    """Keyset pagination: continue a newest-first query on model after the last (created_at, id) seen"""
+    if after_created_at is None:
+        return query
+    if after_id is None:
+        return query.filter(model.created_at < after_created_at)
+    return query.filter(tuple_(model.created_at, model.id) < tuple_(after_created_at, after_id))
+
+def next_cursor(items, has_more):
+    """Get the after_created_at / after_id cursor following a page of serialized rows, or None on the last page"""
+    if not has_more:
+        return None
+    return {
+        'after_created_at': items[-1]['created_at'],
+        'after_id': items[-1]['id']
+    }
@@ -3,9 +3,17 @@ from src.models.user import db, User
 from functools import wraps
 import jwt
 from datetime import datetime
+import os
+import threading
 
 auth_bp = Blueprint('auth', __name__)
 
+# Password hashing is CPU-bound (argon2 releases the GIL while it runs), so cap
+# concurrent checks per process at the core count; excess logins get a 503
+# instead of queueing behind the KDF and starving other requests
+PASSWORD_CHECK_SLOTS = threading.BoundedSemaphore(os.cpu_count() or 1)
+PASSWORD_CHECK_WAIT = 2  # seconds
+
 def token_required(f):
     """Decorator to require valid JWT token"""
     @wraps(f)
@@ -74,7 +82,14 @@ def login():
             return jsonify({'error': 'Account is deactivated'}), 401
         
         # Verify password
-        if not user.check_password(password):
+        if not PASSWORD_CHECK_SLOTS.acquire(timeout=PASSWORD_CHECK_WAIT):
+            return jsonify({'error': 'Server is busy, please retry shortly'}), 503
+        try:
+            password_ok = user.check_password(password)
+        finally:
+            PASSWORD_CHECK_SLOTS.release()
+        
+        if not password_ok:
             user.increment_failed_login()
             db.session.commit()
             
@@ -131,9 +146,22 @@ def refresh_token():
 @token_required
 def logout(current_user):
     """User logout endpoint"""
-    # In a production system, you would typically blacklist the token
-    # For now, we'll just return a success message
-    return jsonify({'message': 'Logout successful'}), 200
+    try:
+        secret_key = current_app.config['SECRET_KEY']
+        token = request.headers['Authorization'].split(" ")[1]
+        User.revoke_jwt_token(token, secret_key)
+        
+        # Revoke the refresh token too when the client sends it
+        data = request.get_json(silent=True) or {}
+        if data.get('refresh_token'):
+            User.revoke_jwt_token(data['refresh_token'], secret_key)
+        
+        db.session.commit()
+        return jsonify({'message': 'Logout successful'}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Logout failed', 'details': str(e)}), 500
 
 @auth_bp.route('/profile', methods=['GET'])
 @token_required
@@ -1,64 +1,186 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from src.models.user import db
-from src.models.customer import Customer, CustomerType
+from src.models.customer import Customer, CustomerType, CUSTOMER_TYPE_VALUES
 from src.routes.auth import token_required
-from sqlalchemy import or_
+from src.cache import cache_get, cache_set, cache_delete, cache_incr
+from src.pagination import cursor_args, after_cursor, next_cursor
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import raiseload
+import hashlib
 
 customer_bp = Blueprint('customer', __name__)
 
+def _is_duplicate_email(error):
+    """Check whether an IntegrityError came from the unique primary_email indexes"""
+    return 'primary_email' in str(error.orig)
+
+# Seconds a serialized customer is served from the shared cache
+CUSTOMER_CACHE_TTL = 300
+
+def _customer_cache_key(customer_id):
+    return f'customer:{customer_id}'
+
+# Seconds a search response is served from the shared cache; any customer
+# write bumps the generation, which retires every cached search at once
+SEARCH_CACHE_TTL = 30
+SEARCH_GENERATION_KEY = 'customer:search:generation'
+
+def _search_cache_key():
+    """Build the cache key for this search request from its arguments"""
+    generation = cache_get(SEARCH_GENERATION_KEY)
+    if generation is None:
+        generation = b'0'
+    args = sorted((name, value.lower() if name == 'q' else value) for name, value in request.args.items())
+    digest = hashlib.sha256(repr(args).encode()).hexdigest()
+    return f'customer:search:{generation.decode()}:{digest}'
+
+# Free-text contact, address and notes fields; stored stripped, blanks as NULL
+_OPTIONAL_TEXT_FIELDS = (
+    'secondary_email', 'phone_primary', 'phone_secondary', 'website',
+    'address_line1', 'address_line2', 'city', 'state_province', 'postal_code', 'country',
+    'billing_address_line1', 'billing_address_line2', 'billing_city',
+    'billing_state_province', 'billing_postal_code', 'billing_country',
+    'notes'
+)
+
+# Name and registration fields that only apply to one customer type, and
+# whether a blank value is stored as NULL
+_TYPE_SPECIFIC_FIELDS = {
+    'first_name': (CustomerType.INDIVIDUAL, False),
+    'last_name': (CustomerType.INDIVIDUAL, False),
+    'organization_name': (CustomerType.ORGANIZATION, False),
+    'organization_type': (CustomerType.ORGANIZATION, False),
+    'tax_id': (CustomerType.ORGANIZATION, True),
+    'registration_number': (CustomerType.ORGANIZATION, True)
+}
+
+# Preference fields stored as sent, with their defaults for new customers
+_PREFERENCE_DEFAULTS = {
+    'preferred_currency': 'USD',
+    'preferred_language': 'en',
+    'payment_terms': 30,
+    'email_notifications': True,
+    'sms_notifications': False,
+    'whatsapp_notifications': False
+}
+
+def _clean_text(value, blank_as_null=True):
+    """Strip a free-text payload value; missing and blank values become None unless blank_as_null is False"""
+    value = value.strip() if isinstance(value, str) else ''
+    return (value or None) if blank_as_null else value
+
+def _customer_kwargs_from_payload(data):
+    """Validate and normalize a create payload into Customer column values; raises ValueError"""
+    if not data.get('primary_email'):
+        raise ValueError('Primary email is required')
+    
+    customer_type = data.get('customer_type', CustomerType.INDIVIDUAL.value)
+    if customer_type not in CUSTOMER_TYPE_VALUES:
+        raise ValueError('Invalid customer type')
+    customer_type = CustomerType(customer_type)
+    
+    # Validate customer type specific requirements
+    if customer_type == CustomerType.INDIVIDUAL:
+        if not data.get('first_name') or not data.get('last_name'):
+            raise ValueError('First name and last name are required for individual customers')
+    else:
+        if not data.get('organization_name'):
+            raise ValueError('Organization name is required for organization customers')
+    
+    # Normalized here as well as by the model validator, so bulk Core
+    # inserts of these values store the same email
+    kwargs = {
+        'customer_type': customer_type,
+        'primary_email': Customer.normalize_email(data['primary_email'])
+    }
+    
+    # Customer type specific fields
+    for field, (field_type, _) in _TYPE_SPECIFIC_FIELDS.items():
+        if field_type == customer_type:
+            kwargs[field] = _clean_text(data.get(field), blank_as_null=False)
+    
+    # Optional contact, address and notes fields
+    for field in _OPTIONAL_TEXT_FIELDS:
+        kwargs[field] = _clean_text(data.get(field))
+    
+    # Preferences and communication preferences
+    for field, default in _PREFERENCE_DEFAULTS.items():
+        kwargs[field] = data.get(field, default)
+    
+    return kwargs
+
 @customer_bp.route('/', methods=['GET'])
 @token_required
 def get_customers(current_user):
     """Get all customers with optional filtering and pagination"""
     try:
         # Get query parameters
-        page = request.args.get('page', 1, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         search = request.args.get('search', '').strip()
         customer_type = request.args.get('type', '').strip()
         is_active = request.args.get('active', 'true').lower() == 'true'
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+        summary = request.args.get('summary', 'false').lower() == 'true'
+        
+        try:
+            after_created_at, after_id = cursor_args()
+        except ValueError:
+            return jsonify({'error': 'Invalid after_created_at format. Use ISO 8601'}), 400
         
         # Build query
         query = Customer.query.filter_by(is_active=is_active)
         
         # Apply customer type filter
-        if customer_type and customer_type in [t.value for t in CustomerType]:
-            query = query.filter_by(customer_type=CustomerType(customer_type))
+        customer_type = customer_type if customer_type in CUSTOMER_TYPE_VALUES else None
+        if customer_type:
+            query = query.filter_by(customer_type=customer_type)
         
         # Apply search filter
         if search:
-            search_term = f"%{search}%"
-            query = query.filter(
-                or_(
-                    Customer.first_name.ilike(search_term),
-                    Customer.last_name.ilike(search_term),
-                    Customer.organization_name.ilike(search_term),
-                    Customer.primary_email.ilike(search_term)
-                )
-            )
+            query = query.filter(Customer.list_search_filter(search))
         
-        # Order by creation date (newest first)
-        query = query.order_by(Customer.created_at.desc())
+        count_query = query
         
-        # Paginate results
-        pagination = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Order by creation date (newest first); id breaks same-timestamp ties
+        query = query.order_by(Customer.created_at.desc(), Customer.id.desc())
         
-        customers = [customer.to_dict() for customer in pagination.items]
+        # Select only the serialized columns; summaries need few enough to be
+        # read straight from ix_customers_active_created on PostgreSQL
+        if summary:
+            query = query.with_entities(*Customer.summary_columns())
+        else:
+            query = query.with_entities(*Customer.serialized_columns())
+        
+        # One extra row tells us whether there is a next page, without a COUNT(*)
+        if after_created_at is not None:
+            # Cursor mode seeks straight to the page on ix_customers_active_created
+            rows = after_cursor(query, Customer, after_created_at, after_id).limit(per_page + 1).all()
+            pagination_data = {'per_page': per_page}
+        else:
+            rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+            pagination_data = {'page': page, 'per_page': per_page, 'has_prev': page > 1}
+        
+        has_next = len(rows) > per_page
+        pagination_data['has_next'] = has_next
+        if summary:
+            customers = Customer.bulk_to_summary_dict(rows[:per_page])
+        else:
+            customers = Customer.bulk_to_dict(rows[:per_page])
+        
+        # Totals cost a full count, so they are opt-in and briefly cached
+        if include_total:
+            total = Customer.cached_count(('list', search.lower(), customer_type, is_active), count_query)
+            pagination_data['total'] = total
+            pagination_data['pages'] = -(-total // per_page)
+        
+        # Pass back as after_created_at / after_id to fetch the next page by cursor
+        pagination_data['next_cursor'] = next_cursor(customers, has_next)
         
         return jsonify({
             'customers': customers,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
-            }
+            'pagination': pagination_data
         }), 200
         
     except Exception as e:
@@ -69,16 +191,26 @@ def get_customers(current_user):
 def get_customer(current_user, customer_id):
     """Get a specific customer by ID"""
     try:
-        customer = Customer.query.get(customer_id)
+        include_history = request.args.get('include_history', 'false').lower() == 'true'
+        
+        # Plain customer records change only through this blueprint, so they
+        # are cached; invoice history changes with every invoice and is not
+        if not include_history:
+            cached = cache_get(_customer_cache_key(customer_id))
+            if cached is not None:
+                return current_app.response_class(cached, mimetype=current_app.json.mimetype), 200
+        
+        # to_dict reads columns only; raiseload keeps it that way
+        customer = Customer.query.options(raiseload('*')).get(customer_id)
         
         if not customer:
             return jsonify({'error': 'Customer not found'}), 404
         
-        include_history = request.args.get('include_history', 'false').lower() == 'true'
+        payload = {'customer': customer.to_dict(include_history=include_history)}
+        if not include_history:
+            cache_set(_customer_cache_key(customer_id), current_app.json.dumps_bytes(payload), CUSTOMER_CACHE_TTL)
         
-        return jsonify({
-            'customer': customer.to_dict(include_history=include_history)
-        }), 200
+        return jsonify(payload), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to retrieve customer', 'details': str(e)}), 500
@@ -93,83 +225,22 @@ def create_customer(current_user):
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        # Validate required fields
-        if not data.get('primary_email'):
-            return jsonify({'error': 'Primary email is required'}), 400
-        
-        customer_type = data.get('customer_type', 'individual')
-        if customer_type not in [t.value for t in CustomerType]:
-            return jsonify({'error': 'Invalid customer type'}), 400
-        
-        # Check for duplicate email
-        existing_customer = Customer.query.filter_by(
-            primary_email=data['primary_email'].lower().strip()
-        ).first()
-        
-        if existing_customer:
-            return jsonify({'error': 'Customer with this email already exists'}), 400
-        
-        # Validate customer type specific requirements
-        if customer_type == 'individual':
-            if not data.get('first_name') or not data.get('last_name'):
-                return jsonify({'error': 'First name and last name are required for individual customers'}), 400
-        elif customer_type == 'organization':
-            if not data.get('organization_name'):
-                return jsonify({'error': 'Organization name is required for organization customers'}), 400
-        
-        # Create new customer
-        customer = Customer(
-            customer_type=CustomerType(customer_type),
-            primary_email=data['primary_email'].lower().strip()
-        )
-        
-        # Set customer type specific fields
-        if customer_type == 'individual':
-            customer.first_name = data.get('first_name', '').strip()
-            customer.last_name = data.get('last_name', '').strip()
-        else:
-            customer.organization_name = data.get('organization_name', '').strip()
-            customer.organization_type = data.get('organization_type', '').strip()
-            customer.tax_id = data.get('tax_id', '').strip()
-            customer.registration_number = data.get('registration_number', '').strip()
-        
-        # Set optional fields
-        customer.secondary_email = data.get('secondary_email', '').strip() or None
-        customer.phone_primary = data.get('phone_primary', '').strip() or None
-        customer.phone_secondary = data.get('phone_secondary', '').strip() or None
-        customer.website = data.get('website', '').strip() or None
-        
-        # Address information
-        customer.address_line1 = data.get('address_line1', '').strip() or None
-        customer.address_line2 = data.get('address_line2', '').strip() or None
-        customer.city = data.get('city', '').strip() or None
-        customer.state_province = data.get('state_province', '').strip() or None
-        customer.postal_code = data.get('postal_code', '').strip() or None
-        customer.country = data.get('country', '').strip() or None
-        
-        # Billing address (if different)
-        customer.billing_address_line1 = data.get('billing_address_line1', '').strip() or None
-        customer.billing_address_line2 = data.get('billing_address_line2', '').strip() or None
-        customer.billing_city = data.get('billing_city', '').strip() or None
-        customer.billing_state_province = data.get('billing_state_province', '').strip() or None
-        customer.billing_postal_code = data.get('billing_postal_code', '').strip() or None
-        customer.billing_country = data.get('billing_country', '').strip() or None
-        
-        # Preferences
-        customer.preferred_currency = data.get('preferred_currency', 'USD')
-        customer.preferred_language = data.get('preferred_language', 'en')
-        customer.payment_terms = data.get('payment_terms', 30)
-        
-        # Communication preferences
-        customer.email_notifications = data.get('email_notifications', True)
-        customer.sms_notifications = data.get('sms_notifications', False)
-        customer.whatsapp_notifications = data.get('whatsapp_notifications', False)
-        
-        # Notes
-        customer.notes = data.get('notes', '').strip() or None
+        try:
+            customer = Customer(**_customer_kwargs_from_payload(data))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         db.session.add(customer)
-        db.session.commit()
+        
+        # Duplicate emails are caught by the unique index rather than a pre-check
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            if _is_duplicate_email(e):
+                return jsonify({'error': 'Customer with this email already exists'}), 400
+            raise
+        cache_incr(SEARCH_GENERATION_KEY)
         
         return jsonify({
             'message': 'Customer created successfully',
@@ -185,91 +256,67 @@ def create_customer(current_user):
 def update_customer(current_user, customer_id):
     """Update an existing customer"""
     try:
-        customer = Customer.query.get(customer_id)
-        
-        if not customer:
-            return jsonify({'error': 'Customer not found'}), 404
-        
         data = request.get_json()
         
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        # Check for duplicate email (if email is being changed)
+        changes = {}
+        
+        # The validator does not run for a bulk UPDATE, so normalize here
         if 'primary_email' in data:
-            new_email = data['primary_email'].lower().strip()
-            if new_email != customer.primary_email:
-                existing_customer = Customer.query.filter_by(primary_email=new_email).first()
-                if existing_customer:
-                    return jsonify({'error': 'Customer with this email already exists'}), 400
-                customer.primary_email = new_email
-        
-        # Update customer type specific fields
-        if customer.customer_type == CustomerType.INDIVIDUAL:
-            if 'first_name' in data:
-                customer.first_name = data['first_name'].strip()
-            if 'last_name' in data:
-                customer.last_name = data['last_name'].strip()
-        else:
-            if 'organization_name' in data:
-                customer.organization_name = data['organization_name'].strip()
-            if 'organization_type' in data:
-                customer.organization_type = data['organization_type'].strip()
-            if 'tax_id' in data:
-                customer.tax_id = data['tax_id'].strip() or None
-            if 'registration_number' in data:
-                customer.registration_number = data['registration_number'].strip() or None
-        
-        # Update contact information
-        if 'secondary_email' in data:
-            customer.secondary_email = data['secondary_email'].strip() or None
-        if 'phone_primary' in data:
-            customer.phone_primary = data['phone_primary'].strip() or None
-        if 'phone_secondary' in data:
-            customer.phone_secondary = data['phone_secondary'].strip() or None
-        if 'website' in data:
-            customer.website = data['website'].strip() or None
-        
-        # Update address information
-        address_fields = [
-            'address_line1', 'address_line2', 'city', 'state_province', 
-            'postal_code', 'country', 'billing_address_line1', 'billing_address_line2',
-            'billing_city', 'billing_state_province', 'billing_postal_code', 'billing_country'
-        ]
-        
-        for field in address_fields:
+            changes['primary_email'] = Customer.normalize_email(data['primary_email'])
+        
+        # Customer type specific fields only apply to customers of that type
+        for field, (customer_type, blank_as_null) in _TYPE_SPECIFIC_FIELDS.items():
+            if field in data:
+                changes[field] = db.case(
+                    (Customer.customer_type == customer_type, _clean_text(data[field], blank_as_null)),
+                    else_=getattr(Customer, field)
+                )
+        
+        # Update contact, address and notes fields
+        for field in _OPTIONAL_TEXT_FIELDS:
             if field in data:
-                setattr(customer, field, data[field].strip() or None)
-        
-        # Update preferences
-        if 'preferred_currency' in data:
-            customer.preferred_currency = data['preferred_currency']
-        if 'preferred_language' in data:
-            customer.preferred_language = data['preferred_language']
-        if 'payment_terms' in data:
-            customer.payment_terms = data['payment_terms']
-        
-        # Update communication preferences
-        if 'email_notifications' in data:
-            customer.email_notifications = data['email_notifications']
-        if 'sms_notifications' in data:
-            customer.sms_notifications = data['sms_notifications']
-        if 'whatsapp_notifications' in data:
-            customer.whatsapp_notifications = data['whatsapp_notifications']
-        
-        # Update notes
-        if 'notes' in data:
-            customer.notes = data['notes'].strip() or None
+                changes[field] = _clean_text(data[field])
+        
+        # Update preferences and communication preferences
+        for field in _PREFERENCE_DEFAULTS:
+            if field in data:
+                changes[field] = data[field]
         
         # Update status
         if 'is_active' in data:
-            customer.is_active = data['is_active']
+            changes['is_active'] = data['is_active']
         
-        db.session.commit()
+        # One UPDATE ... RETURNING writes the changes and reads back the serialized columns
+        if changes:
+            statement = update(Customer).where(Customer.id == customer_id).values(**changes)
+            statement = statement.returning(*Customer.serialized_columns())
+        else:
+            statement = select(*Customer.serialized_columns()).where(Customer.id == customer_id)
+        
+        # Duplicate emails are rejected by the unique index
+        try:
+            row = db.session.execute(
+                statement, execution_options={'synchronize_session': False}
+            ).first()
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            if _is_duplicate_email(e):
+                return jsonify({'error': 'Customer with this email already exists'}), 400
+            raise
+        
+        if row is None:
+            return jsonify({'error': 'Customer not found'}), 404
+        
+        cache_delete(_customer_cache_key(customer_id))
+        cache_incr(SEARCH_GENERATION_KEY)
         
         return jsonify({
             'message': 'Customer updated successfully',
-            'customer': customer.to_dict()
+            'customer': Customer.bulk_to_dict([row])[0]
         }), 200
         
     except Exception as e:
@@ -281,26 +328,30 @@ def update_customer(current_user, customer_id):
 def delete_customer(current_user, customer_id):
     """Soft delete a customer (deactivate)"""
     try:
-        customer = Customer.query.get(customer_id)
-        
-        if not customer:
-            return jsonify({'error': 'Customer not found'}), 404
-        
-        # Check if customer has active invoices
         from src.models.invoice import Invoice, InvoiceStatus
         active_invoices = Invoice.query.filter_by(customer_id=customer_id).filter(
             Invoice.status.in_([InvoiceStatus.DRAFT, InvoiceStatus.SENT])
-        ).count()
+        )
         
-        if active_invoices > 0:
+        # Soft delete (deactivate) in one statement, unless the customer has active invoices
+        result = db.session.execute(
+            update(Customer)
+            .where(Customer.id == customer_id, ~active_invoices.exists())
+            .values(is_active=False)
+        )
+        
+        if result.rowcount == 0:
+            db.session.rollback()
+            if db.session.get(Customer, customer_id) is None:
+                return jsonify({'error': 'Customer not found'}), 404
             return jsonify({
                 'error': 'Cannot delete customer with active invoices',
-                'active_invoices': active_invoices
+                'active_invoices': active_invoices.count()
             }), 400
         
-        # Soft delete (deactivate)
-        customer.is_active = False
         db.session.commit()
+        cache_delete(_customer_cache_key(customer_id))
+        cache_incr(SEARCH_GENERATION_KEY)
         
         return jsonify({'message': 'Customer deactivated successfully'}), 200
         
@@ -316,21 +367,56 @@ def search_customers(current_user):
         query = request.args.get('q', '').strip()
         customer_type = request.args.get('type', '').strip()
         limit = min(request.args.get('limit', 10, type=int), 50)
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+        summary = request.args.get('summary', 'false').lower() == 'true'
         
         if not query:
             return jsonify({'customers': []}), 200
         
-        # Use the Customer.search class method
+        try:
+            after_created_at, after_id = cursor_args()
+        except ValueError:
+            return jsonify({'error': 'Invalid after_created_at format. Use ISO 8601'}), 400
+        
+        customer_type = customer_type if customer_type in CUSTOMER_TYPE_VALUES else None
+        
+        # Typeahead sends bursts of the same search, so whole responses are cached briefly
+        cache_key = _search_cache_key()
+        cached = cache_get(cache_key)
+        if cached is not None:
+            return current_app.response_class(cached, mimetype=current_app.json.mimetype), 200
+        
+        # Use the Customer.search class method; one extra row tells us whether there is a next page
         search_query = Customer.search(
             query=query,
-            customer_type=CustomerType(customer_type) if customer_type and customer_type in [t.value for t in CustomerType] else None
+            customer_type=customer_type,
+            after_created_at=after_created_at,
+            after_id=after_id,
+            limit=limit + 1
         )
         
-        customers = search_query.limit(limit).all()
+        # Typeahead callers can ask for a summary, which selects only a handful of columns
+        if summary:
+            customers = search_query.with_entities(*Customer.summary_columns()).all()
+            has_more = len(customers) > limit
+            customers = Customer.bulk_to_summary_dict(customers[:limit])
+        else:
+            customers = search_query.with_entities(*Customer.serialized_columns()).all()
+            has_more = len(customers) > limit
+            customers = Customer.bulk_to_dict(customers[:limit])
         
-        return jsonify({
-            'customers': [customer.to_dict() for customer in customers]
-        }), 200
+        response = {
+            'customers': customers,
+            'has_more': has_more,
+            'next_cursor': next_cursor(customers, has_more)
+        }
+        
+        if include_total:
+            response['total'] = Customer.search_count(query, customer_type)
+        
+        cache_set(cache_key, current_app.json.dumps_bytes(response), SEARCH_CACHE_TTL)
+        
+        return jsonify(response), 200
         
     except Exception as e:
         return jsonify({'error': 'Search failed', 'details': str(e)}), 500
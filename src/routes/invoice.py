@@ -1,33 +1,122 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file
 from src.models.user import db
 from src.models.customer import Customer
-from src.models.invoice import Invoice, InvoiceLineItem, InvoiceStatus, InvoiceStatusHistory
+from src.models.invoice import Invoice, InvoiceLineItem, InvoiceStatus, InvoiceStatusHistory, INVOICE_STATUS_BY_VALUE, INVOICE_STATUS_TRANSITIONS
+from src.models.history import queue_history
 from src.routes.auth import token_required
-from datetime import datetime, timedelta
-from sqlalchemy import or_, and_
+from src.pagination import cursor_args, after_cursor, next_cursor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import joinedload
+import io
 
 invoice_bp = Blueprint('invoice', __name__)
 
+def _parse_date(value):
+    """Parse a YYYY-MM-DD date string; raises ValueError like strptime"""
+    # Zero-padded dates take fromisoformat's C fast path; anything else goes
+    # through strptime so the accepted formats stay exactly the same
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return date.fromisoformat(value)
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def _line_item_values(items):
+    """Validate request line items and convert them to column values; raises ValueError"""
+    values = []
+    for item_data in items:
+        if not item_data.get('description') or not item_data.get('quantity') or not item_data.get('unit_price'):
+            raise ValueError('Each line item must have description, quantity, and unit_price')
+        
+        values.append({
+            'description': item_data['description'].strip(),
+            'quantity': item_data['quantity'],
+            'unit_price': item_data['unit_price'],
+            'unit_of_measure': item_data.get('unit_of_measure', '').strip() or None,
+            'product_code': item_data.get('product_code', '').strip() or None
+        })
+    return values
+
+def _insert_line_items(invoice_id, values):
+    """Insert line items for an invoice with one executemany INSERT"""
+    if values:
+        # render_nulls keeps rows with and without optional fields in one batch
+        db.session.execute(
+            insert(InvoiceLineItem).execution_options(render_nulls=True),
+            [dict(item, invoice_id=invoice_id) for item in values]
+        )
+
+# Line item columns set from request data, compared to decide which lines changed
+_LINE_ITEM_FIELDS = ('description', 'quantity', 'unit_price', 'unit_of_measure', 'product_code')
+
+def _sync_line_items(invoice_id, items, values):
+    """Write only the difference between an invoice's line items and the request; raises ValueError"""
+    existing = {
+        row.id: row for row in db.session.execute(
+            select(InvoiceLineItem.id, *(getattr(InvoiceLineItem, field) for field in _LINE_ITEM_FIELDS))
+            .where(InvoiceLineItem.invoice_id == invoice_id)
+        )
+    }
+    
+    # Items sent with an id update that line, items without one are added,
+    # and lines left out are removed
+    updates, inserts, kept = [], [], set()
+    for item_data, item in zip(items, values):
+        line_id = item_data.get('id')
+        if line_id is None:
+            inserts.append(item)
+            continue
+        if line_id not in existing or line_id in kept:
+            raise ValueError(f'Line item {line_id} does not belong to this invoice')
+        kept.add(line_id)
+        
+        current = existing[line_id]
+        if any(_line_item_value_changed(getattr(current, field), item[field]) for field in _LINE_ITEM_FIELDS):
+            updates.append(dict(item, id=line_id))
+    
+    removed = existing.keys() - kept
+    if removed:
+        db.session.execute(delete(InvoiceLineItem).where(InvoiceLineItem.id.in_(removed)))
+    if updates:
+        db.session.execute(update(InvoiceLineItem), updates)
+    _insert_line_items(invoice_id, inserts)
+
+def _line_item_value_changed(current, new):
+    """Compare a stored line item value with a request value (numbers as Decimals)"""
+    if isinstance(current, Decimal) and new is not None:
+        try:
+            return current != Decimal(str(new))
+        except ArithmeticError:
+            return True
+    return current != new
+
 @invoice_bp.route('/', methods=['GET'])
 @token_required
 def get_invoices(current_user):
     """Get all invoices with optional filtering and pagination"""
     try:
         # Get query parameters
-        page = request.args.get('page', 1, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         search = request.args.get('search', '').strip()
         status = request.args.get('status', '').strip()
         customer_id = request.args.get('customer_id', type=int)
         date_from = request.args.get('date_from', '').strip()
         date_to = request.args.get('date_to', '').strip()
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
         
-        # Build query
-        query = Invoice.query
+        try:
+            after_created_at, after_id = cursor_args()
+        except ValueError:
+            return jsonify({'error': 'Invalid after_created_at format. Use ISO 8601'}), 400
+        
+        # Build query; customers come back in the same query as their invoices
+        query = Invoice.query_with_children(include_line_items=False)
         
         # Apply status filter
-        if status and status in [s.value for s in InvoiceStatus]:
-            query = query.filter_by(status=InvoiceStatus(status))
+        status = INVOICE_STATUS_BY_VALUE.get(status)
+        if status:
+            query = query.filter_by(status=status)
         
         # Apply customer filter
         if customer_id:
@@ -36,55 +125,52 @@ def get_invoices(current_user):
         # Apply date range filter
         if date_from:
             try:
-                from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
+                from_date = _parse_date(date_from)
                 query = query.filter(Invoice.issue_date >= from_date)
             except ValueError:
                 return jsonify({'error': 'Invalid date_from format. Use YYYY-MM-DD'}), 400
         
         if date_to:
             try:
-                to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
+                to_date = _parse_date(date_to)
                 query = query.filter(Invoice.issue_date <= to_date)
             except ValueError:
                 return jsonify({'error': 'Invalid date_to format. Use YYYY-MM-DD'}), 400
         
         # Apply search filter
         if search:
-            search_term = f"%{search}%"
-            query = query.join(Customer).filter(
-                or_(
-                    Invoice.invoice_number.ilike(search_term),
-                    Invoice.reference_number.ilike(search_term),
-                    Invoice.po_number.ilike(search_term),
-                    Customer.first_name.ilike(search_term),
-                    Customer.last_name.ilike(search_term),
-                    Customer.organization_name.ilike(search_term),
-                    Customer.primary_email.ilike(search_term)
-                )
-            )
+            query = query.filter(Invoice.search_filter(search))
         
-        # Order by creation date (newest first)
-        query = query.order_by(Invoice.created_at.desc())
+        count_query = query
         
-        # Paginate results
-        pagination = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Order by creation date (newest first); id breaks same-timestamp ties
+        query = query.order_by(Invoice.created_at.desc(), Invoice.id.desc())
         
-        invoices = [invoice.to_dict(include_line_items=False) for invoice in pagination.items]
+        # One extra row tells us whether there is a next page, without a COUNT(*)
+        if after_created_at is not None:
+            # Cursor mode seeks straight to the page on ix_invoices_created
+            rows = after_cursor(query, Invoice, after_created_at, after_id).limit(per_page + 1).all()
+            pagination_data = {'per_page': per_page}
+        else:
+            rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+            pagination_data = {'page': page, 'per_page': per_page, 'has_prev': page > 1}
+        
+        has_next = len(rows) > per_page
+        pagination_data['has_next'] = has_next
+        invoices = [invoice.to_dict(include_line_items=False) for invoice in rows[:per_page]]
+        
+        # Totals cost a full count, so they are opt-in
+        if include_total:
+            total = count_query.count()
+            pagination_data['total'] = total
+            pagination_data['pages'] = -(-total // per_page)
+        
+        # Pass back as after_created_at / after_id to fetch the next page by cursor
+        pagination_data['next_cursor'] = next_cursor(invoices, has_next)
         
         return jsonify({
             'invoices': invoices,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
-            }
+            'pagination': pagination_data
         }), 200
         
     except Exception as e:
@@ -95,14 +181,18 @@ def get_invoices(current_user):
 def get_invoice(current_user, invoice_id):
     """Get a specific invoice by ID"""
     try:
-        invoice = Invoice.query.get(invoice_id)
+        include_payments = request.args.get('include_payments', 'false').lower() == 'true'
+        include_history = request.args.get('include_history', 'false').lower() == 'true'
+        
+        invoice = Invoice.query_with_children(
+            include_line_items=True,
+            include_payments=include_payments,
+            include_history=include_history
+        ).filter_by(id=invoice_id).first()
         
         if not invoice:
             return jsonify({'error': 'Invoice not found'}), 404
         
-        include_payments = request.args.get('include_payments', 'false').lower() == 'true'
-        include_history = request.args.get('include_history', 'false').lower() == 'true'
-        
         return jsonify({
             'invoice': invoice.to_dict(
                 include_line_items=True,
@@ -131,6 +221,11 @@ def create_invoice(current_user):
         if not data.get('line_items') or not isinstance(data['line_items'], list):
             return jsonify({'error': 'At least one line item is required'}), 400
         
+        try:
+            line_items = _line_item_values(data['line_items'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Verify customer exists
         customer = Customer.query.get(data['customer_id'])
         if not customer:
@@ -148,13 +243,17 @@ def create_invoice(current_user):
         # Set dates
         if data.get('issue_date'):
             try:
-                invoice.issue_date = datetime.strptime(data['issue_date'], '%Y-%m-%d').date()
+                invoice.issue_date = _parse_date(data['issue_date'])
             except ValueError:
                 return jsonify({'error': 'Invalid issue_date format. Use YYYY-MM-DD'}), 400
+        else:
+            # Set explicitly; the column default only applies at insert and
+            # the due date below is derived from it
+            invoice.issue_date = datetime.utcnow().date()
         
         if data.get('due_date'):
             try:
-                invoice.due_date = datetime.strptime(data['due_date'], '%Y-%m-%d').date()
+                invoice.due_date = _parse_date(data['due_date'])
             except ValueError:
                 return jsonify({'error': 'Invalid due_date format. Use YYYY-MM-DD'}), 400
         else:
@@ -169,7 +268,7 @@ def create_invoice(current_user):
         
         if data.get('delivery_date'):
             try:
-                invoice.delivery_date = datetime.strptime(data['delivery_date'], '%Y-%m-%d').date()
+                invoice.delivery_date = _parse_date(data['delivery_date'])
             except ValueError:
                 return jsonify({'error': 'Invalid delivery_date format. Use YYYY-MM-DD'}), 400
         
@@ -188,35 +287,22 @@ def create_invoice(current_user):
         db.session.add(invoice)
         db.session.flush()
         
-        # Create line items
-        for item_data in data['line_items']:
-            if not item_data.get('description') or not item_data.get('quantity') or not item_data.get('unit_price'):
-                return jsonify({'error': 'Each line item must have description, quantity, and unit_price'}), 400
-            
-            line_item = InvoiceLineItem(
-                invoice_id=invoice.id,
-                description=item_data['description'].strip(),
-                quantity=item_data['quantity'],
-                unit_price=item_data['unit_price'],
-                unit_of_measure=item_data.get('unit_of_measure', '').strip() or None,
-                product_code=item_data.get('product_code', '').strip() or None
-            )
-            line_item.calculate_total()
-            db.session.add(line_item)
+        # Create line items; totals are computed by the database, so nothing
+        # needs to be read back per row
+        _insert_line_items(invoice.id, line_items)
         
         # Calculate invoice totals
-        db.session.flush()  # Ensure line items are saved
         invoice.calculate_totals()
         
         # Create initial status history
-        history = InvoiceStatusHistory(
-            invoice_id=invoice.id,
+        queue_history(
+            InvoiceStatusHistory, invoice, 'invoice_id',
             old_status=InvoiceStatus.DRAFT,
             new_status=InvoiceStatus.DRAFT,
+            changed_at=datetime.utcnow(),
             changed_by=current_user.id,
             notes="Invoice created"
         )
-        db.session.add(history)
         
         db.session.commit()
         
@@ -258,20 +344,20 @@ def update_invoice(current_user, invoice_id):
         # Update dates
         if 'issue_date' in data:
             try:
-                invoice.issue_date = datetime.strptime(data['issue_date'], '%Y-%m-%d').date()
+                invoice.issue_date = _parse_date(data['issue_date'])
             except ValueError:
                 return jsonify({'error': 'Invalid issue_date format. Use YYYY-MM-DD'}), 400
         
         if 'due_date' in data:
             try:
-                invoice.due_date = datetime.strptime(data['due_date'], '%Y-%m-%d').date()
+                invoice.due_date = _parse_date(data['due_date'])
             except ValueError:
                 return jsonify({'error': 'Invalid due_date format. Use YYYY-MM-DD'}), 400
         
         if 'delivery_date' in data:
             if data['delivery_date']:
                 try:
-                    invoice.delivery_date = datetime.strptime(data['delivery_date'], '%Y-%m-%d').date()
+                    invoice.delivery_date = _parse_date(data['delivery_date'])
                 except ValueError:
                     return jsonify({'error': 'Invalid delivery_date format. Use YYYY-MM-DD'}), 400
             else:
@@ -295,24 +381,15 @@ def update_invoice(current_user, invoice_id):
         
         # Update line items if provided
         if 'line_items' in data:
-            # Remove existing line items
-            InvoiceLineItem.query.filter_by(invoice_id=invoice.id).delete()
+            try:
+                line_items = _line_item_values(data['line_items'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            # Add new line items
-            for item_data in data['line_items']:
-                if not item_data.get('description') or not item_data.get('quantity') or not item_data.get('unit_price'):
-                    return jsonify({'error': 'Each line item must have description, quantity, and unit_price'}), 400
-                
-                line_item = InvoiceLineItem(
-                    invoice_id=invoice.id,
-                    description=item_data['description'].strip(),
-                    quantity=item_data['quantity'],
-                    unit_price=item_data['unit_price'],
-                    unit_of_measure=item_data.get('unit_of_measure', '').strip() or None,
-                    product_code=item_data.get('product_code', '').strip() or None
-                )
-                line_item.calculate_total()
-                db.session.add(line_item)
+            try:
+                _sync_line_items(invoice.id, data['line_items'], line_items)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         # Recalculate totals
         db.session.flush()
@@ -344,24 +421,15 @@ def update_invoice_status(current_user, invoice_id):
         if not data or not data.get('status'):
             return jsonify({'error': 'Status is required'}), 400
         
-        new_status = data['status']
-        if new_status not in [s.value for s in InvoiceStatus]:
+        new_status_enum = INVOICE_STATUS_BY_VALUE.get(data['status'])
+        if new_status_enum is None:
             return jsonify({'error': 'Invalid status'}), 400
         
-        new_status_enum = InvoiceStatus(new_status)
         notes = data.get('notes', '').strip() or None
         
         # Validate status transition
         current_status = invoice.status
-        valid_transitions = {
-            InvoiceStatus.DRAFT: [InvoiceStatus.SENT, InvoiceStatus.CANCELLED],
-            InvoiceStatus.SENT: [InvoiceStatus.PAID, InvoiceStatus.OVERDUE, InvoiceStatus.CANCELLED],
-            InvoiceStatus.OVERDUE: [InvoiceStatus.PAID, InvoiceStatus.CANCELLED],
-            InvoiceStatus.PAID: [],  # Paid invoices cannot change status
-            InvoiceStatus.CANCELLED: [InvoiceStatus.DRAFT]  # Can reactivate cancelled invoices
-        }
-        
-        if new_status_enum not in valid_transitions.get(current_status, []):
+        if new_status_enum not in INVOICE_STATUS_TRANSITIONS[current_status]:
             return jsonify({
                 'error': f'Cannot change status from {current_status.value} to {new_status_enum.value}'
             }), 400
@@ -401,6 +469,28 @@ def get_invoice_qr_code(current_user, invoice_id):
     except Exception as e:
         return jsonify({'error': 'Failed to generate QR code', 'details': str(e)}), 500
 
+@invoice_bp.route('/<int:invoice_id>/qr-code.png', methods=['GET'])
+@token_required
+def get_invoice_qr_code_png(current_user, invoice_id):
+    """Serve the invoice payment QR code as a PNG image"""
+    try:
+        invoice = Invoice.query.get(invoice_id)
+        
+        if not invoice:
+            return jsonify({'error': 'Invoice not found'}), 404
+        
+        base_url = request.args.get('base_url', 'https://wasatpay.com')
+        
+        # Raw PNG bytes, without the base64 data URI encoding
+        return send_file(
+            io.BytesIO(invoice.generate_qr_code_png(base_url)),
+            mimetype='image/png',
+            download_name=f"Invoice_{invoice.invoice_number}_qr.png"
+        )
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to generate QR code', 'details': str(e)}), 500
+
 @invoice_bp.route('/stats', methods=['GET'])
 @token_required
 def get_invoice_stats(current_user):
@@ -415,47 +505,57 @@ def get_invoice_stats(current_user):
         # Apply date filter if provided
         if date_from:
             try:
-                from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
+                from_date = _parse_date(date_from)
                 query = query.filter(Invoice.issue_date >= from_date)
             except ValueError:
                 return jsonify({'error': 'Invalid date_from format. Use YYYY-MM-DD'}), 400
         
         if date_to:
             try:
-                to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
+                to_date = _parse_date(date_to)
                 query = query.filter(Invoice.issue_date <= to_date)
             except ValueError:
                 return jsonify({'error': 'Invalid date_to format. Use YYYY-MM-DD'}), 400
         
-        # Get all invoices for the period
-        invoices = query.all()
-        
-        # Calculate statistics
-        total_invoices = len(invoices)
-        total_amount = sum(float(invoice.total_amount) for invoice in invoices)
+        # Counts and sums per status come back from one GROUP BY; overdue
+        # totals are aggregated alongside and only counted for SENT invoices
+        today = datetime.utcnow().date()
+        is_past_due = Invoice.due_date < today
+        rows = query.with_entities(
+            Invoice.status,
+            db.func.count(Invoice.id),
+            db.func.sum(Invoice.total_amount),
+            db.func.count(db.case((is_past_due, Invoice.id))),
+            db.func.sum(db.case((is_past_due, Invoice.total_amount)))
+        ).group_by(Invoice.status).all()
         
         # Group by status
-        status_counts = {}
-        status_amounts = {}
-        
-        for status in InvoiceStatus:
-            status_invoices = [inv for inv in invoices if inv.status == status]
-            status_counts[status.value] = len(status_invoices)
-            status_amounts[status.value] = sum(float(inv.total_amount) for inv in status_invoices)
-        
-        # Calculate overdue invoices
-        overdue_invoices = [inv for inv in invoices if inv.is_overdue]
+        status_counts = {status.value: 0 for status in InvoiceStatus}
+        status_amounts = {status.value: 0.0 for status in InvoiceStatus}
+        total_invoices = 0
+        total_amount = Decimal('0')
+        overdue_count = 0
+        overdue_amount = 0.0
+        
+        for status, count, amount, past_due_count, past_due_amount in rows:
+            status_counts[status.value] = count
+            status_amounts[status.value] = float(amount or 0)
+            total_invoices += count
+            total_amount += Decimal(amount or 0)
+            if status == InvoiceStatus.SENT:
+                overdue_count = past_due_count
+                overdue_amount = float(past_due_amount or 0)
         
         # Recent invoices
-        recent_invoices = sorted(invoices, key=lambda x: x.created_at, reverse=True)[:5]
+        recent_invoices = query.options(joinedload(Invoice.customer)).order_by(Invoice.created_at.desc()).limit(5).all()
         
         return jsonify({
             'total_invoices': total_invoices,
-            'total_amount': total_amount,
+            'total_amount': float(total_amount),
             'status_counts': status_counts,
             'status_amounts': status_amounts,
-            'overdue_count': len(overdue_invoices),
-            'overdue_amount': sum(float(inv.total_amount) for inv in overdue_invoices),
+            'overdue_count': overdue_count,
+            'overdue_amount': overdue_amount,
             'recent_invoices': [inv.to_dict(include_line_items=False) for inv in recent_invoices]
         }), 200
         
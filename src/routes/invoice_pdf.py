@@ -1,14 +1,16 @@
-from flask import Blueprint, request, jsonify, send_file, current_app
+from flask import Blueprint, request, jsonify, current_app
 from src.models.user import db
-from src.models.invoice import Invoice
+from src.models.invoice import Invoice, InvoiceStatus
 from src.routes.auth import token_required
 from src.services.invoice_service import invoice_service
-import io
 import tempfile
 import os
 
 invoice_pdf_bp = Blueprint('invoice_pdf', __name__)
 
+# Concurrent mail server connections used by one bulk email request
+BULK_EMAIL_WORKERS = 4
+
 @invoice_pdf_bp.route('/<int:invoice_id>/pdf', methods=['GET'])
 @token_required
 def generate_invoice_pdf(current_user, invoice_id):
@@ -21,21 +23,23 @@ def generate_invoice_pdf(current_user, invoice_id):
         
         base_url = request.args.get('base_url', request.host_url.rstrip('/'))
         
-        # Generate PDF
-        pdf_data = invoice_service.generate_invoice_pdf(invoice, base_url)
+        # The content fingerprint doubles as the ETag; a client that already
+        # has this PDF gets a 304 without it being rendered or fetched
+        fingerprint = invoice_service.invoice_pdf_fingerprint(invoice, base_url)
+        if fingerprint in request.if_none_match:
+            return '', 304, {'ETag': f'"{fingerprint}"'}
         
-        # Create a temporary file to serve the PDF
-        pdf_buffer = io.BytesIO(pdf_data)
-        pdf_buffer.seek(0)
+        # Generate PDF
+        pdf_data = invoice_service.generate_invoice_pdf(invoice, base_url, fingerprint=fingerprint)
         
+        # The bytes are already in memory (rendered or cached), so they are
+        # the response body as-is rather than being re-read through a file wrapper
         filename = f"Invoice_{invoice.invoice_number}.pdf"
         
-        return send_file(
-            pdf_buffer,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/pdf'
-        )
+        response = current_app.response_class(pdf_data, mimetype='application/pdf')
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+        response.set_etag(fingerprint)
+        return response
         
     except Exception as e:
         current_app.logger.error(f"Error generating PDF for invoice {invoice_id}: {str(e)}")
@@ -182,9 +186,17 @@ def send_bulk_invoice_emails(current_user):
         successful = 0
         failed = 0
         
+        # One query loads every invoice with the customer and line items the
+        # emails render
+        invoices = Invoice.query_with_children(include_line_items=True).filter(Invoice.id.in_(invoice_ids)).all()
+        invoices_by_id = {invoice.id: invoice for invoice in invoices}
+        
+        # Messages are built here, where the database session lives; only the
+        # mail server round trips run concurrently
+        outgoing = []
         for invoice_id in invoice_ids:
             try:
-                invoice = Invoice.query.get(invoice_id)
+                invoice = invoices_by_id.get(invoice_id)
                 
                 if not invoice:
                     results.append({
@@ -195,35 +207,17 @@ def send_bulk_invoice_emails(current_user):
                     failed += 1
                     continue
                 
-                # Send email
-                success = invoice_service.send_invoice_email(
+                msg = invoice_service.build_invoice_email(
                     invoice=invoice,
                     recipient_email=invoice.customer.primary_email,
                     include_pdf=include_pdf,
                     base_url=base_url
                 )
                 
-                if success:
-                    # Update invoice status to sent if it was draft
-                    if invoice.status.value == 'draft':
-                        from src.models.invoice import InvoiceStatus
-                        invoice.update_status(InvoiceStatus.SENT, current_user.id, "Invoice sent via bulk email")
-                    
-                    results.append({
-                        'invoice_id': invoice_id,
-                        'invoice_number': invoice.invoice_number,
-                        'status': 'success',
-                        'recipient': invoice.customer.primary_email
-                    })
-                    successful += 1
-                else:
-                    results.append({
-                        'invoice_id': invoice_id,
-                        'status': 'error',
-                        'message': 'Failed to send email'
-                    })
-                    failed += 1
-                    
+                # Placeholder, filled in once the send completes
+                results.append(None)
+                outgoing.append((len(results) - 1, invoice, msg))
+                
             except Exception as e:
                 results.append({
                     'invoice_id': invoice_id,
@@ -232,6 +226,30 @@ def send_bulk_invoice_emails(current_user):
                 })
                 failed += 1
         
+        # Send email
+        errors = invoice_service.send_messages([msg for _, _, msg in outgoing], max_workers=BULK_EMAIL_WORKERS)
+        
+        for (index, invoice, msg), error in zip(outgoing, errors):
+            if error is None:
+                # Update invoice status to sent if it was draft
+                if invoice.status == InvoiceStatus.DRAFT:
+                    invoice.update_status(InvoiceStatus.SENT, current_user.id, "Invoice sent via bulk email")
+                
+                results[index] = {
+                    'invoice_id': invoice.id,
+                    'invoice_number': invoice.invoice_number,
+                    'status': 'success',
+                    'recipient': invoice.customer.primary_email
+                }
+                successful += 1
+            else:
+                results[index] = {
+                    'invoice_id': invoice.id,
+                    'status': 'error',
+                    'message': str(error)
+                }
+                failed += 1
+        
         db.session.commit()
         
         return jsonify({
@@ -4,6 +4,7 @@ from src.models.invoice import Invoice, InvoiceStatus
 from src.models.payment import Payment, PaymentStatus, PaymentMethod, PaymentProvider, PaymentRefund
 from src.routes.auth import token_required
 from datetime import datetime
+from decimal import Decimal
 
 payment_bp = Blueprint('payment', __name__)
 
@@ -63,7 +64,7 @@ def get_payments(current_user):
             error_out=False
         )
         
-        payments = [payment.to_dict() for payment in pagination.items]
+        payments = [payment.to_dict() for payment in Payment.preload_refunds(pagination.items)]
         
         return jsonify({
             'payments': payments,
@@ -380,14 +381,15 @@ def get_payment_stats(current_user):
             except ValueError:
                 return jsonify({'error': 'Invalid date_to format. Use YYYY-MM-DD'}), 400
         
-        # Get all payments for the period
-        payments = query.all()
+        # Only the aggregated columns are loaded, as plain rows rather than
+        # full Payment instances, to keep large periods cheap in memory
+        payments = query.with_entities(Payment.status, Payment.method, Payment.provider, Payment.amount).all()
         
         # Calculate statistics
         total_payments = len(payments)
-        total_amount = sum(float(payment.amount) for payment in payments)
+        total_amount = float(sum((payment.amount for payment in payments), Decimal('0')))
         successful_payments = [p for p in payments if p.status == PaymentStatus.COMPLETED]
-        total_successful_amount = sum(float(p.amount) for p in successful_payments)
+        total_successful_amount = float(sum((p.amount for p in successful_payments), Decimal('0')))
         
         # Group by status
         status_counts = {}
@@ -396,7 +398,7 @@ def get_payment_stats(current_user):
         for status in PaymentStatus:
             status_payments = [p for p in payments if p.status == status]
             status_counts[status.value] = len(status_payments)
-            status_amounts[status.value] = sum(float(p.amount) for p in status_payments)
+            status_amounts[status.value] = float(sum((p.amount for p in status_payments), Decimal('0')))
         
         # Group by method
         method_counts = {}
@@ -405,7 +407,7 @@ def get_payment_stats(current_user):
         for method in PaymentMethod:
             method_payments = [p for p in payments if p.method == method]
             method_counts[method.value] = len(method_payments)
-            method_amounts[method.value] = sum(float(p.amount) for p in method_payments)
+            method_amounts[method.value] = float(sum((p.amount for p in method_payments), Decimal('0')))
         
         # Group by provider
         provider_counts = {}
@@ -414,10 +416,10 @@ def get_payment_stats(current_user):
         for provider in PaymentProvider:
             provider_payments = [p for p in payments if p.provider == provider]
             provider_counts[provider.value] = len(provider_payments)
-            provider_amounts[provider.value] = sum(float(p.amount) for p in provider_payments)
+            provider_amounts[provider.value] = float(sum((p.amount for p in provider_payments), Decimal('0')))
         
         # Recent payments
-        recent_payments = sorted(payments, key=lambda x: x.created_at, reverse=True)[:5]
+        recent_payments = query.order_by(Payment.created_at.desc()).limit(5).all()
         
         return jsonify({
             'total_payments': total_payments,
@@ -431,7 +433,7 @@ def get_payment_stats(current_user):
             'method_amounts': method_amounts,
             'provider_counts': provider_counts,
             'provider_amounts': provider_amounts,
-            'recent_payments': [p.to_dict() for p in recent_payments]
+            'recent_payments': [p.to_dict() for p in Payment.preload_refunds(recent_payments)]
         }), 200
         
     except Exception as e:
@@ -1,13 +1,19 @@
 from flask import Blueprint, request, jsonify
 from src.models.user import db
 from src.models.project import Project, ProjectStatus, FundingType, ProjectMilestone
+from src.models.invoice import Invoice
 from src.routes.auth import token_required
 from src.services.foundation_service import foundation_service
 from datetime import datetime
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, raiseload, selectinload
 
 project_bp = Blueprint('project', __name__)
 
+# Most invoices included in one project detail response; clients page through
+# the rest with invoices_after_id
+PROJECT_INVOICES_LIMIT = 200
+
 @project_bp.route('/', methods=['GET'])
 @token_required
 def get_projects(current_user):
@@ -22,8 +28,12 @@ def get_projects(current_user):
         funding_type = request.args.get('funding_type', '').strip()
         is_active = request.args.get('active', 'true').lower() == 'true'
         
-        # Build query
-        query = Project.query.filter_by(is_active=is_active)
+        # Build query; to_dict serializes the manager of every project, and any
+        # other relationship access would be an N+1, so it raises instead
+        query = Project.query.options(
+            joinedload(Project.project_manager),
+            raiseload('*')
+        ).filter_by(is_active=is_active)
         
         # Apply status filter
         if status and status in [s.value for s in ProjectStatus]:
@@ -81,28 +91,46 @@ def get_projects(current_user):
 def get_project(current_user, project_id):
     """Get a specific project by ID"""
     try:
-        project = Project.query.get(project_id)
+        include_invoices = request.args.get('include_invoices', 'false').lower() == 'true'
+        include_milestones = request.args.get('include_milestones', 'false').lower() == 'true'
+        invoices_after_id = request.args.get('invoices_after_id', type=int)
+        
+        query = Project.query.options(joinedload(Project.project_manager))
+        if include_milestones:
+            query = query.options(selectinload(Project.milestones))
+        query = query.options(raiseload('*'))
+        project = query.filter_by(id=project_id).first()
         
         if not project:
             return jsonify({'error': 'Project not found'}), 404
         
-        include_invoices = request.args.get('include_invoices', 'false').lower() == 'true'
-        include_milestones = request.args.get('include_milestones', 'false').lower() == 'true'
-        
-        project_data = project.to_dict(include_invoices=include_invoices)
+        project_data = project.to_dict()
         
         # Add financial summary
-        project_data['financial_summary'] = {
-            'total_invoiced': project.get_total_invoiced(),
-            'budget_utilization': project.get_budget_utilization(),
-            'remaining_budget': project.get_remaining_budget(),
-            'is_budget_exceeded': project.is_budget_exceeded()
-        }
+        project_data['financial_summary'] = project.get_budget_summary()
         
         # Add milestones if requested
         if include_milestones:
             project_data['milestones'] = [milestone.to_dict() for milestone in project.milestones]
         
+        # Invoice lists can be long, so at most PROJECT_INVOICES_LIMIT are
+        # included, with a cursor for the next page
+        if include_invoices:
+            invoices_query = Invoice.query.options(
+                joinedload(Invoice.customer)
+            ).filter_by(project_id=project.id)
+            if invoices_after_id is not None:
+                invoices_query = invoices_query.filter(Invoice.id > invoices_after_id)
+            invoices = invoices_query.order_by(Invoice.id).limit(PROJECT_INVOICES_LIMIT + 1).all()
+            
+            has_more = len(invoices) > PROJECT_INVOICES_LIMIT
+            invoices = invoices[:PROJECT_INVOICES_LIMIT]
+            project_data['invoices'] = [invoice.to_dict(include_line_items=False) for invoice in invoices]
+            project_data['invoices_has_more'] = has_more
+            project_data['invoices_next_cursor'] = {
+                'invoices_after_id': invoices[-1].id
+            } if has_more else None
+        
         return jsonify({
             'project': project_data
         }), 200
@@ -357,28 +385,34 @@ def get_project_templates(current_user):
 def get_project_stats(current_user):
     """Get project statistics"""
     try:
-        # Get all projects
-        projects = Project.query.filter_by(is_active=True).all()
+        # Aggregate in the database rather than loading every active project
+        projects = Project.query.filter_by(is_active=True)
         
         # Calculate statistics
-        total_projects = len(projects)
-        total_budget = sum(float(p.total_budget) for p in projects if p.total_budget)
-        total_invoiced = sum(p.get_total_invoiced() for p in projects)
+        total_projects, total_budget, total_invoiced = projects.with_entities(
+            db.func.count(Project.id),
+            db.func.coalesce(db.func.sum(Project.total_budget_cents), 0),
+            db.func.coalesce(db.func.sum(Project.total_invoiced), 0)
+        ).one()
+        # Integer cents sum in the database; convert once at the edge
+        total_budget = total_budget / 100
+        total_invoiced = float(total_invoiced)
         
         # Group by status
-        status_counts = {}
-        for status in ProjectStatus:
-            status_projects = [p for p in projects if p.status == status]
-            status_counts[status.value] = len(status_projects)
+        status_counts = {status.value: 0 for status in ProjectStatus}
+        for status, count in projects.with_entities(Project.status, db.func.count(Project.id)).group_by(Project.status):
+            status_counts[status.value] = count
         
         # Group by service area
-        service_area_counts = {}
-        for project in projects:
-            if project.service_area:
-                service_area_counts[project.service_area] = service_area_counts.get(project.service_area, 0) + 1
+        service_area_counts = dict(projects.filter(
+            Project.service_area.isnot(None),
+            Project.service_area != ''
+        ).with_entities(Project.service_area, db.func.count(Project.id)).group_by(Project.service_area).all())
         
         # Recent projects
-        recent_projects = sorted(projects, key=lambda x: x.created_at, reverse=True)[:5]
+        recent_projects = projects.options(
+            joinedload(Project.project_manager)
+        ).order_by(Project.created_at.desc()).limit(5).all()
         
         return jsonify({
             'total_projects': total_projects,
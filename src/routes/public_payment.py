@@ -4,6 +4,7 @@ from src.models.invoice import Invoice, InvoiceStatus
 from src.models.payment import Payment, PaymentStatus, PaymentMethod, PaymentProvider
 from src.services.invoice_service import invoice_service
 from datetime import datetime
+from decimal import Decimal
 
 public_payment_bp = Blueprint('public_payment', __name__)
 
@@ -313,7 +314,7 @@ def payment_receipt(invoice_uuid):
                 }
                 for payment in completed_payments
             ],
-            'total_paid': sum(float(p.amount) for p in completed_payments),
+            'total_paid': float(sum((p.amount for p in completed_payments), Decimal('0'))),
             'organization': {
                 'name': 'Wasat Humanitarian Foundation',
                 'logo': invoice_service._get_logo_path()
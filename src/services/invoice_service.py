@@ -1,14 +1,19 @@
 import os
-import io
 import base64
+import hashlib
 from datetime import datetime
 from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from jinja2 import Template
 from weasyprint import HTML, CSS
-from flask import current_app, url_for
+from flask import current_app, has_request_context, request, url_for
 from flask_mail import Mail, Message
-import qrcode
 from PIL import Image, ImageDraw
+from src.cache import cache_get, cache_set
+
+# Seconds a rendered invoice PDF is served from the shared cache; the PDF
+# shows the generation date, so entries are never useful for much longer
+INVOICE_PDF_CACHE_TTL = 24 * 60 * 60
 
 class InvoiceService:
     def __init__(self, app=None):
@@ -30,9 +35,28 @@ class InvoiceService:
         
         self.mail = Mail(app)
     
-    def generate_invoice_pdf(self, invoice, base_url="https://wasatpay.com"):
+    def invoice_pdf_fingerprint(self, invoice, base_url="https://wasatpay.com"):
+        """Hash everything the invoice PDF shows; equal fingerprints mean identical PDFs"""
+        content = {
+            'invoice': invoice.to_dict(include_line_items=True),
+            'customer': invoice.customer.to_dict(),
+            'base_url': base_url,
+            'generated_date': datetime.now().strftime('%B %d, %Y')
+        }
+        return hashlib.sha256(current_app.json.dumps_bytes(content)).hexdigest()
+    
+    def generate_invoice_pdf(self, invoice, base_url="https://wasatpay.com", fingerprint=None):
         """Generate PDF invoice with professional template"""
         try:
+            # Rendered PDFs are cached by content, so any change to the invoice,
+            # its line items or its customer renders a fresh one
+            cache_key = None
+            if self._pdf_cacheable(base_url):
+                cache_key = f'invoice:pdf:{invoice.id}:{fingerprint or self.invoice_pdf_fingerprint(invoice, base_url)}'
+                cached = cache_get(cache_key)
+                if cached is not None:
+                    return cached
+            
             # Generate QR code for payment
             qr_code_data = self._generate_qr_code(invoice, base_url)
             
@@ -50,87 +74,92 @@ class InvoiceService:
             # Generate HTML from template
             html_content = self._render_invoice_template(template_data)
             
-            # Generate PDF
-            pdf_buffer = io.BytesIO()
-            HTML(string=html_content, base_url=base_url).write_pdf(
-                pdf_buffer,
+            # Generate PDF straight to bytes, without an intermediate buffer
+            pdf_data = HTML(string=html_content, base_url=base_url).write_pdf(
                 stylesheets=[CSS(string=self._get_invoice_css())]
             )
-            
-            pdf_buffer.seek(0)
-            return pdf_buffer.getvalue()
+            if cache_key:
+                cache_set(cache_key, pdf_data, INVOICE_PDF_CACHE_TTL)
+            return pdf_data
             
         except Exception as e:
             current_app.logger.error(f"Error generating invoice PDF: {str(e)}")
             raise
     
+    @staticmethod
+    def _pdf_cacheable(base_url):
+        """Whether a PDF for base_url may be cached; in a request, only for the app's own origin"""
+        return not has_request_context() or base_url == request.host_url.rstrip('/')
+    
+    def build_invoice_email(self, invoice, recipient_email=None, include_pdf=True, base_url="https://wasatpay.com"):
+        """Build the invoice email message with optional PDF attachment"""
+        recipient = recipient_email or invoice.customer.primary_email
+        
+        # Generate email content
+        email_data = {
+            'invoice': invoice.to_dict(include_line_items=True),
+            'customer': invoice.customer.to_dict(),
+            'payment_url': f"{base_url}/pay/{invoice.uuid}",
+            'base_url': base_url
+        }
+        
+        subject = f"Invoice {invoice.invoice_number} from Wasat Humanitarian Foundation"
+        html_body = self._render_email_template(email_data)
+        
+        # Create message
+        msg = Message(
+            subject=subject,
+            recipients=[recipient],
+            html=html_body
+        )
+        
+        # Attach PDF if requested
+        if include_pdf:
+            pdf_data = self.generate_invoice_pdf(invoice, base_url)
+            msg.attach(
+                filename=f"Invoice_{invoice.invoice_number}.pdf",
+                content_type="application/pdf",
+                data=pdf_data
+            )
+        
+        return msg
+    
     def send_invoice_email(self, invoice, recipient_email=None, include_pdf=True, base_url="https://wasatpay.com"):
         """Send invoice via email with optional PDF attachment"""
         try:
-            recipient = recipient_email or invoice.customer.primary_email
-            
-            # Generate email content
-            email_data = {
-                'invoice': invoice.to_dict(include_line_items=True),
-                'customer': invoice.customer.to_dict(),
-                'payment_url': f"{base_url}/pay/{invoice.uuid}",
-                'base_url': base_url
-            }
-            
-            subject = f"Invoice {invoice.invoice_number} from Wasat Humanitarian Foundation"
-            html_body = self._render_email_template(email_data)
-            
-            # Create message
-            msg = Message(
-                subject=subject,
-                recipients=[recipient],
-                html=html_body
-            )
-            
-            # Attach PDF if requested
-            if include_pdf:
-                pdf_data = self.generate_invoice_pdf(invoice, base_url)
-                msg.attach(
-                    filename=f"Invoice_{invoice.invoice_number}.pdf",
-                    content_type="application/pdf",
-                    data=pdf_data
-                )
-            
-            # Send email
-            self.mail.send(msg)
-            
+            self.mail.send(self.build_invoice_email(invoice, recipient_email, include_pdf, base_url))
             return True
             
         except Exception as e:
             current_app.logger.error(f"Error sending invoice email: {str(e)}")
             raise
     
+    def send_messages(self, messages, max_workers=4):
+        """Send built messages concurrently; returns None or the send error for each, in order"""
+        app = current_app._get_current_object()
+        
+        def send(msg):
+            # Sending only talks to the mail server, never the database session
+            with app.app_context():
+                try:
+                    self.mail.send(msg)
+                except Exception as e:
+                    app.logger.error(f"Error sending email to {', '.join(msg.recipients)}: {str(e)}")
+                    return e
+            return None
+        
+        if not messages:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(messages))) as executor:
+            return list(executor.map(send, messages))
+    
     def create_payment_link(self, invoice, base_url="https://wasatpay.com"):
         """Create a secure payment link for the invoice"""
         return f"{base_url}/pay/{invoice.uuid}"
     
     def _generate_qr_code(self, invoice, base_url):
         """Generate QR code for invoice payment"""
-        payment_url = f"{base_url}/pay/{invoice.uuid}"
-        
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(payment_url)
-        qr.make(fit=True)
-        
-        # Create QR code image
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
-        return f"data:image/png;base64,{img_str}"
+        return invoice.generate_qr_code(base_url)
     
     def _get_logo_path(self):
         """Get the path to the Wasat logo"""